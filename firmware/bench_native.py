@@ -0,0 +1,81 @@
+# Control loop kernels benchmark on the device: machine code (viper) versions against
+# pure Python fallbacks, and servo tick cost with either set. Tick methods themselves are
+# compiled with @micropython.native in both cases. Motor pins aren't touched. No device figures are recorded yet.
+#
+#   mpremote cp idle_motor.py : + run bench_native.py
+
+import time
+from machine import Pin, Signal
+
+from idle_motor import IdleMotor
+from wa import servo
+from wa.servo import PositionSensor, Servo
+
+
+ROUNDS = 2000
+TICKS = 200  # paced at control period, so the stall detector takes a sample and fits the slope on each tick
+
+
+def rate(func, *args) -> int:
+    # """
+    # Calls per second
+    # """
+    start = time.ticks_us()
+    for _ in range(ROUNDS):
+        func(*args)
+    return ROUNDS * 1000000 // max(1, time.ticks_diff(time.ticks_us(), start))
+
+
+def servo_tick_us(profile: bool) -> int:
+    # """
+    # Mean tick duration of servo moving to far target, us
+    # """
+    led = Signal(2, Pin.OPEN_DRAIN, invert=True)
+    sensor = PositionSensor(filter_type=PositionSensor.FILTER_MEDIAN, samples=7)
+    srv = Servo(IdleMotor(), sensor, led, stall_speed=-65535, profile=profile)  # never stalls
+    srv.position = 1 if sensor.position < 0.5 else 0
+    total = 0
+    for _ in range(TICKS):
+        time.sleep_ms(Servo.CONTROL_PERIOD_MS)
+        start = time.ticks_us()
+        srv.tick()
+        total += time.ticks_diff(time.ticks_us(), start)
+    return total // TICKS
+
+
+def main():
+    sensor = PositionSensor(filter_type=PositionSensor.FILTER_MEDIAN, samples=7)
+    ring = sensor._ring
+    buf = sensor._sorted
+
+    srv = Servo(IdleMotor(), sensor, Signal(2, Pin.OPEN_DRAIN, invert=True))
+    times = srv._v_time
+    raws = srv._v_raw
+    n = len(times)
+    for i in range(n):
+        times[i] = i * 20
+        raws[i] = i * 37
+
+    pot = (sensor._table[0] + sensor._table[-1]) // 2
+    lookup = (sensor._table, sensor._base, sensor._seg_slope, sensor._seg, sensor._last_seg, pot, servo.SLOPE_SHIFT)
+
+    kernels = (
+        ('median', (servo._median_py, servo._median), (ring, buf, len(ring))),
+        ('slope', (servo._slope_py, servo._slope), (times, raws, 3, n, n)),
+        ('to_fixed', (servo._to_fixed_py, servo._to_fixed), lookup),
+    )
+    native = (servo._median, servo._slope, servo._to_fixed)
+    print(f'machine code kernels: {servo.NATIVE}')
+    for name, (py, nat), args in kernels:
+        print(f'{name}: {rate(py, *args)} calls/s python, {rate(nat, *args)} calls/s native')
+
+    for profile in (False, True):
+        servo._median, servo._slope, servo._to_fixed = servo._median_py, servo._slope_py, servo._to_fixed_py
+        before = servo_tick_us(profile)
+        servo._median, servo._slope, servo._to_fixed = native
+        after = servo_tick_us(profile)
+        print(f'servo {"profile" if profile else "on/off"} tick: {before} us ({1000000 // max(1, before)}/s) python '
+              f'kernels, {after} us ({1000000 // max(1, after)}/s) native')
+
+
+main()
@@ -10,6 +10,9 @@ espr=~/esp/espressif/xtensa-lx106-elf/bin  # Espressif ESP8266 toolchain
 
 source ../venv/bin/activate
 
+python3 compile_templates.py
+python3 build_assets.py
+
 cd $upy
 git checkout master
 git pull
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Build web UI static assets for upload to device filesystem: minify, gzip and index them.
+# Templates are skipped, they are frozen into firmware by compile_templates.py.
+#
+#   ./build_assets.py [assets dir] [output dir]
+
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ASSETS_INDEX = 'assets.json'
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=UTF-8',
+    '.css': 'text/css',
+    '.js': 'application/javascript',
+    '.ico': 'image/x-icon',
+    '.png': 'image/png',
+    '.svg': 'image/svg+xml',
+}
+
+
+def minify(name: str, data: bytes) -> bytes:
+    # """
+    # Strip comments and insignificant whitespace from HTML and CSS
+
+    # :param name: file name
+    # :param data: file content
+    # :return: minified content
+    # """
+    ext = os.path.splitext(name)[1]
+    if ext not in ('.html', '.css'):
+        return data
+
+    text = data.decode('utf8')
+    if ext == '.css':
+        text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+        text = re.sub(r'\s+', ' ', text)
+        text = re.sub(r'\s*([{};:,>])\s*', r'\1', text)
+        text = text.replace(';}', '}')
+    else:
+        text = re.sub(r'<!--.*?-->', '', text, flags=re.S)
+        text = re.sub(r'>\s+<', '><', text)
+        text = re.sub(r'\s+', ' ', text)
+
+    return text.strip().encode('utf8')
+
+
+def build_assets(src_dir: str, out_dir: str) -> dict:
+    # """
+    # Write gzipped static assets and their index with ETags, sizes and content types
+
+    # :param src_dir: assets directory
+    # :param out_dir: output directory
+    # :return: assets index
+    # """
+    os.makedirs(out_dir, exist_ok=True)
+
+    index = {}
+    for src in sorted(glob.glob(os.path.join(src_dir, '*'))):
+        name = os.path.basename(src)
+        with open(src, 'rb') as f:
+            data = f.read()
+        if data.startswith(b'{%'):
+            continue  # template
+
+        # fixed mtime keeps output and ETag reproducible
+        packed = gzip.compress(minify(name, data), compresslevel=9, mtime=0)
+        with open(os.path.join(out_dir, name + '.gz'), 'wb') as f:
+            f.write(packed)
+
+        index[name] = {
+            'etag': hashlib.sha1(packed).hexdigest()[:16],
+            'size': len(packed),
+            'type': CONTENT_TYPES.get(os.path.splitext(name)[1], 'application/octet-stream'),
+        }
+        print(f'{name}: {len(data)} -> {len(packed)} bytes')
+
+    with open(os.path.join(out_dir, ASSETS_INDEX), 'w', encoding='utf8') as f:
+        json.dump(index, f)
+
+    return index
+
+
+if __name__ == '__main__':
+    src_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(PROJECT_DIR, 'src_alive', 'html')
+    out_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join(PROJECT_DIR, 'firmware', 'build', 'src_alive', 'html')
+
+    build_assets(src_dir, out_dir)
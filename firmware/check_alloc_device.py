@@ -0,0 +1,54 @@
+# Steady-state control ticks must not allocate: checked on the device with gc.mem_alloc() around
+# a series of ticks, for both control modes and all position filters. Motor pins aren't touched.
+# CPython boxes ints above 256, so the simulator can't check it. Not run on hardware yet.
+#
+#   mpremote cp idle_motor.py : + run check_alloc_device.py
+
+import gc
+from machine import Pin, Signal
+
+from idle_motor import IdleMotor
+from wa.servo import PositionSensor, Servo
+
+
+WARMUP_TICKS = 50  # first ticks fill velocity estimator and trace buffers
+TICKS = 500
+
+
+def allocated(profile: bool, filter_type: int) -> int:
+    # """
+    # Bytes allocated by steady-state ticks of servo moving to far target
+    # """
+    led = Signal(2, Pin.OPEN_DRAIN, invert=True)
+    sensor = PositionSensor(0.2, 0.8, filter_type=filter_type, samples=7)
+    srv = Servo(IdleMotor(), sensor, led, stall_speed=-65535, profile=profile)  # never stalls
+    srv.position = 1 if sensor.position < 0.5 else 0
+    for _ in range(WARMUP_TICKS):
+        srv._step()
+
+    gc.collect()
+    gc.disable()  # collection would hide allocations
+    try:
+        before = gc.mem_alloc()
+        for _ in range(TICKS):
+            srv._step()
+        return gc.mem_alloc() - before
+    finally:
+        gc.enable()
+
+
+def main():
+    failed = 0
+    for profile in (False, True):
+        for filter_name in ('FILTER_NONE', 'FILTER_MEDIAN', 'FILTER_EMA'):
+            delta = allocated(profile, getattr(PositionSensor, filter_name))
+            ok = delta == 0
+            failed += not ok
+            mode = 'profile' if profile else 'on/off'
+            print(f'{"PASS" if ok else "FAIL"} {mode} {filter_name}: {delta} B in {TICKS} ticks')
+
+    assert not failed, f'{failed} cases allocate in steady state'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# Compile utemplate templates to Python modules to be frozen into firmware,
+# so the device neither compiles templates nor writes to its filesystem at runtime.
+#
+#   ./compile_templates.py [templates dir] [output package dir]
+
+import glob
+import os
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'ext_modules', 'utemplate'))
+
+from utemplate.source import Compiler  # noqa: E402
+
+
+def compile_templates(src_dir: str, out_dir: str) -> list:
+    # """
+    # Compile every template (file starting with `{%` statement) of source directory
+
+    # :param src_dir: templates directory
+    # :param out_dir: output package directory, module names follow utemplate.compiled.Loader convention
+    # :return: compiled modules paths
+    # """
+    os.makedirs(out_dir, exist_ok=True)
+    open(os.path.join(out_dir, '__init__.py'), 'w').close()
+
+    modules = []
+    for src in sorted(glob.glob(os.path.join(src_dir, '*.html'))):
+        with open(src, encoding='utf8') as f_in:
+            if not f_in.read(2) == '{%':
+                continue  # static file
+            f_in.seek(0)
+
+            name = os.path.basename(src).replace('.', '_') + '.py'
+            out = os.path.join(out_dir, name)
+            with open(out, 'w', encoding='utf8') as f_out:
+                Compiler(f_in, f_out).compile()
+            modules.append(out)
+
+    return modules
+
+
+if __name__ == '__main__':
+    src_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(PROJECT_DIR, 'src_alive', 'html')
+    out_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join(PROJECT_DIR, 'firmware', 'build', 'templates')
+
+    for module in compile_templates(src_dir, out_dir):
+        print(module)
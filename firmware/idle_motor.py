@@ -0,0 +1,39 @@
+# Motor stand-in for control loop checks and benchmarks on the device and in the simulator.
+# It's a Motor with the whole attribute surface, so control code sees what it sees on real hardware.
+
+from wa.servo import Motor
+
+
+class _NoPin:
+    # """
+    # Sink of pin and PWM writes
+    # """
+
+    def on(self):
+        pass
+
+    def off(self):
+        pass
+
+    def duty_u16(self, duty_u16: int):
+        pass
+
+
+class IdleMotor(Motor):
+    # """
+    # Motor reporting rotation, so ticks run the whole moving path without moving the window.
+    # Motor pins aren't touched.
+    # """
+
+    def __init__(self, power: float = 1, min_power: float = 0):
+        # """
+        # :param power: rotation speed/power, [0-1]
+        # :param min_power: power needed to overcome static friction, [0-1]
+        # """
+        self._power = self._cw_pin = self._ccw_pin = self._led = _NoPin()
+        self.duty_u16 = 0
+        self.set_power(power, min_power)
+        self.ccw()
+
+    def stop(self):
+        pass  # keep ticking as if running
@@ -1,8 +1,8 @@
 freeze("$(PORT_DIR)/modules")
 include("$(MPY_DIR)/extmod/asyncio")
-require("umqtt.simple")
 
 package("utemplate", base_path="../ext_modules/utemplate")
+package("templates", base_path="build")  # compile_templates.py output
 package("microdot", base_path="../ext_modules/microdot/src")
 
 package("wa", base_path="../freeze")
@@ -1,4 +1,4 @@
 #!/usr/bin/env -S rshell --port /dev/ttyUSB0 --file
 
-rsync --mirror ../src_alive /pyboard  # never remove /pyboard from dest!
+rsync --mirror build/src_alive /pyboard  # build_assets.py output. Never remove /pyboard from dest!
 repl~ import machine~ machine.soft_reset()
@@ -1,43 +1,115 @@
 import asyncio
-import time
-from machine import Pin, Signal, reset
+from machine import Pin, Signal, SoftI2C, reset
 import network
-import ubinascii
 
 from microdot import Request
 from microdot.utemplate import Template
-
-from wa.mqtt import MQTTWindowActuator
-from wa.servo import Motor, PositionSensor, Servo
-from wa.web import web_server, HTML_ROOT
+from microdot.websocket import WebSocket, with_websocket
+from utemplate import compiled
+
+from wa import diag, live, startup, trace, wifi
+from wa.ads1115 import ADS1115
+from wa.mqtt import MQTTWindowActuator, WindowCover
+from wa.servo import CalibrationInterrupted, Motor, PositionSensor, Servo
+from wa.web import web_server
 from wa.settings import config
 
+startup.mark('import')
+
 
 PASSWORD_MASK = '*' * 8
+MOTOR_CHANNELS = {  # TB6612FNG channel -> IN1, IN2, PWM GPIOs, see hardware/commutation_scheme.md
+    'A': (13, 15, 4),  # D7, D8, D2
+    'B': (16, 14, 5),  # D0, D5, D1
+}
+I2C_SCL = 12  # D6, external ADC bus
+I2C_SDA = 0  # D3
+MOVEMENT_SETTINGS = ('motor_power', 'motor_min_power', 'window_opened_pos', 'window_closed_pos')
 
 
 mqtt_wa: MQTTWindowActuator = None
-Template.initialize(template_dir=HTML_ROOT)
+actuators = []  # (Motor, PositionSensor) of each window
+calibrating = set()  # indexes of windows being calibrated
+ext_adc: ADS1115 = None
+Template.initialize(template_dir='templates', loader_class=compiled.Loader)  # frozen, see compile_templates.py
 
 
 @web_server.route('/window.html')
 async def _window(request: Request):
     if mqtt_wa:
-        return Template('window.html').render(pos=round(mqtt_wa.position * 100))
+        windows = [(window.name, round(window.position * 100)) for window in mqtt_wa.windows]
+        return diag.metered_iter('templates', Template('window.html').generate(windows=windows))
     else:
         return 'Not connected to MQTT server'
 
 
+@web_server.route('/live')
+@with_websocket
+@web_server.websocket_session
+async def _live(request: Request, ws: WebSocket):
+    if mqtt_wa:
+        await live.stream(ws, mqtt_wa, config.live_period_ms)
+
+
+@web_server.route('/boot.json')
+async def _boot(request: Request):
+    return startup.phases()
+
+
+@web_server.route('/metrics')
+async def _metrics(request: Request):
+    diag.largest_free_block()
+    return diag.prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+def _trace(request: Request):
+    # """
+    # Motion trace of window given by query: live one or saved on stall ('stall' argument)
+
+    # :return: trace, window; None if there is no such window or trace
+    # """
+    window = mqtt_wa and mqtt_wa.window(request.args.get('window'))
+    if not window:
+        return None, None
+
+    if 'stall' in request.args:
+        return trace.Recorder.load(trace.SNAPSHOT_PATH.format(window.name)), window
+    return window.servo.trace, window
+
+
+@web_server.route('/trace.csv')
+async def _trace_csv(request: Request):
+    rec, window = _trace(request)
+    if rec is None:
+        return 'No trace', 404
+    return rec.csv(window.servo.pos_sensor.to_fixed), 200, {'Content-Type': 'text/csv'}
+
+
+@web_server.route('/trace.bin')
+async def _trace_bin(request: Request):
+    rec, window = _trace(request)
+    if rec is None:
+        return 'No trace', 404
+    return rec.binary(), 200, {
+        'Content-Type': 'application/octet-stream',
+        'Content-Disposition': f'attachment; filename="trace_{window.name}.bin"'
+    }
+
+
 @web_server.route('/set_position', methods=['POST'])
 async def _set_position(request: Request):
-    if mqtt_wa:
-        mqtt_wa.position = float(request.form['position']) / 100
+    window = mqtt_wa and mqtt_wa.window(request.form.get('window'))
+    if window:
+        position = WindowCover.parse_position(request.form.get('position', ''))
+        if position is None:
+            return 'Invalid position', 400
+        window.position = position
     return ''
 
 
 @web_server.route('/network.html')
 async def _settings(request: Request):
-    return Template('network.html').render(
+    return diag.metered_iter('templates', Template('network.html').generate(
         device_name=config.device_name,
         wifi_ssid=config.wifi_ssid,
         wifi_password=PASSWORD_MASK if config.wifi_password else '',
@@ -45,11 +117,15 @@ async def _settings(request: Request):
         mqtt_port=config.mqtt_port,
         mqtt_user=config.mqtt_user,
         mqtt_password=PASSWORD_MASK if config.mqtt_password else ''
-    )
+    ))
 
 
 @web_server.route('/set_network', methods=['POST'])
 async def _set_network(request: Request):
+    # WiFi and device name changes need restart, MQTT server is switched on the fly
+    restart_cfg = (config.device_name, config.wifi_ssid, config.wifi_password)
+    mqtt_cfg = (config.mqtt_server, config.mqtt_port, config.mqtt_user, config.mqtt_password)
+
     config.device_name = request.form['device_name']
     config.wifi_ssid = request.form['wifi_ssid']
 
@@ -65,25 +141,40 @@ async def _set_network(request: Request):
     if mqtt_pwd != PASSWORD_MASK:
         config.mqtt_password = mqtt_pwd
 
-    config.save()
-    reset()
+    if not config.save():
+        return ''
+
+    if restart_cfg != (config.device_name, config.wifi_ssid, config.wifi_password):
+        reset()
+
+    if mqtt_wa and mqtt_cfg != (config.mqtt_server, config.mqtt_port, config.mqtt_user, config.mqtt_password):
+        mqtt_wa.reconfigure(
+            server=config.mqtt_server,
+            port=config.mqtt_port,
+            user=config.mqtt_user,
+            password=config.mqtt_password
+        )
+    return ''
 
 
 @web_server.route('/movement.html')
 async def _movement(request: Request):
-    return Template('movement.html').render(
+    windows = [(wnd['name'], 'position_table' in wnd) for wnd in map(window_settings, range(len(actuators)))]
+    return diag.metered_iter('templates', Template('movement.html').generate(
         motor_power=config.motor_power,
         window_opened_pos=config.window_opened_pos,
-        window_closed_pos=config.window_closed_pos
-    )
+        window_closed_pos=config.window_closed_pos,
+        windows=windows
+    ))
 
 
 @web_server.route('/set_movement', methods=['POST'])
 async def _set_movement(request: Request):
     config.motor_power = request.form['motor_power']
+    endpoints = (config.window_opened_pos, config.window_closed_pos)
 
-    wnd_opened = request.form['window_opened_pos']
-    wnd_closed = request.form['window_closed_pos']
+    wnd_opened = int(request.form['window_opened_pos'])
+    wnd_closed = int(request.form['window_closed_pos'])
 
     if wnd_opened > wnd_closed:
         # if wnd_opened != config.window_opened_pos:
@@ -96,59 +187,218 @@ async def _set_movement(request: Request):
             # if mqtt_wa:
             #     mqtt_wa.position = float(wnd_closed) / 100
 
-    config.save()
-    reset()
+    if endpoints != (config.window_opened_pos, config.window_closed_pos):
+        # hand tuned endpoints replace calibration of windows which follow them
+        config.windows = [
+            wnd if 'window_opened_pos' in wnd or 'window_closed_pos' in wnd
+            else {key: val for key, val in wnd.items() if key != 'position_table'}
+            for wnd in config.windows
+        ]
+
+    if config.save():
+        apply_movement_settings()
+    return ''
+
+
+@web_server.route('/calibrate', methods=['POST'])
+async def _calibrate(request: Request):
+    window = mqtt_wa and mqtt_wa.window(request.form.get('window'))
+    if window:
+        i = mqtt_wa.windows.index(window)
+        if i in calibrating:
+            return 'Calibration is in progress', 409
+        calibrating.add(i)
+        asyncio.create_task(calibrate(i))
+    return ''
+
+
+async def calibrate(i: int):
+    # """
+    # Measure window position sensor table and keep it in settings. The window returns to its position,
+    # unless a command was given meanwhile.
+
+    # :param i: window index
+    # """
+    window = mqtt_wa.windows[i]
+    position = window.servo.position
+    try:
+        table = await window.servo.calibrate()
+    except CalibrationInterrupted:
+        return  # the window follows the command
+    except (ValueError, OSError) as e:  # OSError: position sensor read failed
+        print(f'Calibration of {window.name} failed: {e}')
+        table = None
+    finally:
+        calibrating.discard(i)
+
+    if table:
+        print(f'Calibrated {window.name}: {table}')
+        windows = [dict(wnd) for wnd in config.windows]
+        windows[i]['position_table'] = table
+        config.windows = windows
+        config.save()
+
+    # cover takes the position calibration left the window at, then moves back through command intake
+    window.stop()
+    window.position = position
+
+
+def window_settings(i: int) -> dict:
+    # """
+    # Window description with defaults filled in. The first window is wired to driver channel A and
+    # built-in ADC, the second one to channel B and external ADC input 0. Movement settings of the window
+    # override common ones.
+
+    # :param i: window index in settings
+    # """
+    wnd = {
+        'name': WindowCover.FIRST_NAME if i == 0 else f'window{i + 1}',
+        'channel': 'A' if i == 0 else 'B',
+        'sensor': 'adc' if i == 0 else f'ads1115:{i - 1}'
+    }
+    for key in MOVEMENT_SETTINGS:
+        wnd[key] = getattr(config, key)
+    if isinstance(config.windows[i], dict):  # malformed one is reported by main()
+        wnd.update(config.windows[i])
+    wnd['motor_min_power'] = min(wnd['motor_min_power'], wnd['motor_power'])
+    return wnd
+
+
+def position_source(spec: str):
+    # """
+    # Potentiometer reader
+
+    # :param spec: 'adc' for built-in ADC, 'ads1115:<input>' for external I2C ADC input
+    # :return: reader with read_u16() method, None for built-in ADC
+    # """
+    if spec == 'adc':
+        return None
+
+    kind, _, channel = spec.partition(':')
+    if kind != 'ads1115' or channel not in ('0', '1', '2', '3'):
+        raise ValueError(f'Unknown position sensor: {spec}')
+
+    global ext_adc
+    if ext_adc is None:
+        ext_adc = ADS1115(SoftI2C(scl=Pin(I2C_SCL), sda=Pin(I2C_SDA), freq=400000))
+    return ext_adc.channel(int(channel))
+
+
+def apply_movement_settings():
+    # """
+    # Apply motor power and window end positions to running servos
+    # """
+    for i, (motor, pos_sensor) in enumerate(actuators):
+        wnd = window_settings(i)
+        motor.set_power(wnd['motor_power'] / 100, wnd['motor_min_power'] / 100)
+        set_position_mapping(pos_sensor, wnd)
+
+
+def set_position_mapping(pos_sensor: PositionSensor, wnd: dict):
+    # """
+    # Calibrated position table if there is one, linear mapping between endpoints otherwise
+
+    # :param pos_sensor: window position sensor
+    # :param wnd: window settings
+    # """
+    table = wnd.get('position_table')
+    if table:
+        pos_sensor.set_table(table)
+    else:
+        pos_sensor.set_bounds(wnd['window_closed_pos'] / 100, wnd['window_opened_pos'] / 100)
 
 
 def exception_handler(loop, context):
     # """
     # asyncio exception handler
     # """
-    print(f'Reset due to error: {context['exception']}')
+    print(f'Reset due to error: {context["exception"]}')
     reset()
 
 
-def main():
-    status_led = Signal(2, Pin.OPEN_DRAIN, invert=True)
-
+async def _network(status_led: Signal):
+    # """
+    # Bring up WiFi, then MQTT. Servo and web server are working meanwhile.
+    # """
     # disable access point
     # ap_if = network.WLAN(network.AP_IF)
     # ap_if.active(False)
 
-    # connect to Wi-Fi
-    nic = network.WLAN(network.STA_IF)
-    mac = ubinascii.hexlify(nic.config('mac')).decode()
     network.hostname(config.device_name)
-    nic.connect(config.wifi_ssid, config.wifi_password)
-    print('Connecting to WiFi', end='')
-    while not nic.isconnected():
-        time.sleep(1)
-        print('.', end='')
-        status_led.value(not status_led.value())
-
+    print('Connecting to WiFi')
     if_cfg = dict(zip(
         ('IP', 'subnet', 'gateway', 'DNS'),
-        nic.ifconfig()
+        await wifi.connect(
+            config.wifi_ssid, config.wifi_password, status_led,
+            idle=lambda: not any(motor.running for motor, _ in actuators)
+        )
     ))
-    print(f'\nNetwork config: {if_cfg}')
-    status_led.off()
-
-    motor = Motor(
-        cw_pin=Pin(13, Pin.OUT),
-        ccw_pin=Pin(15, Pin.OUT),
-        pwm_pin=Pin(4, Pin.OUT),
-        status_led=status_led,
-        power=config.motor_power / 100
-    )
-    pos = PositionSensor(
-        pos_min=config.window_closed_pos / 100,
-        pos_max=config.window_opened_pos / 100
-    )
-    servo = Servo(
-        motor=motor,
-        pos_sensor=pos,
-        status_led=status_led
-    )
+    print(f'Network config: {if_cfg}')
+    startup.mark('wifi')
+
+    asyncio.create_task(mqtt_wa.run())
+    while not mqtt_wa.connected:
+        await asyncio.sleep_ms(100)
+    startup.mark('mqtt')
+    while mqtt_wa.queued:
+        await asyncio.sleep_ms(100)
+    startup.mark('discovery')
+
+
+def main():
+    status_led = Signal(2, Pin.OPEN_DRAIN, invert=True)
+
+    servos = []
+    used = set()  # channels and sensors of configured windows
+    for i in range(len(config.windows)):
+        # the rest of windows is left out, so indexes of driven windows match settings
+        if i >= len(MOTOR_CHANNELS):
+            print(f'Only {len(MOTOR_CHANNELS)} windows can be driven, the rest are ignored')
+            break
+        wnd = window_settings(i)
+        try:
+            if not isinstance(config.windows[i], dict):
+                raise ValueError('Settings are not an object')
+            if wnd['channel'] not in MOTOR_CHANNELS or wnd['channel'] in used or wnd['sensor'] in used:
+                raise ValueError(f'Channel {wnd["channel"]} or sensor {wnd["sensor"]} is invalid or taken')
+            source = position_source(wnd['sensor'])
+        except (ValueError, TypeError, AttributeError) as e:
+            if i:
+                print(f'Window {wnd["name"]}: {e}, it and the next ones are ignored')
+                break
+            # the first window keeps the device reachable, so its settings can be fixed from web UI
+            print(f'Window {wnd["name"]}: {e}, driven by channel A and built-in ADC')
+            wnd['channel'], wnd['sensor'] = 'A', 'adc'
+            source = None
+        used.add(wnd['channel'])
+        used.add(wnd['sensor'])
+        cw_pin, ccw_pin, pwm_pin = MOTOR_CHANNELS[wnd['channel']]
+        motor = Motor(
+            cw_pin=Pin(cw_pin, Pin.OUT),
+            ccw_pin=Pin(ccw_pin, Pin.OUT),
+            pwm_pin=Pin(pwm_pin, Pin.OUT),
+            status_led=status_led,
+            power=wnd['motor_power'] / 100,
+            min_power=wnd['motor_min_power'] / 100
+        )
+        # missing external ADC doesn't fail here: the servo stalls on readings until it answers
+        pos_sensor = PositionSensor(
+            filter_type=PositionSensor.FILTER_MEDIAN,
+            samples=7,
+            burst=1 if source else None,  # external ADC conversion blocks for a while, one per tick
+            source=source
+        )
+        try:
+            set_position_mapping(pos_sensor, wnd)
+        except (ValueError, TypeError, OverflowError) as e:
+            print(f'Window {wnd["name"]} position mapping is invalid: {e}, full sensor range is used')
+        servos.append((wnd['name'], Servo(
+            motor=motor,
+            pos_sensor=pos_sensor,
+            status_led=status_led,
+            profile=bool(config.motion_profile)
+        )))
+        actuators.append((motor, pos_sensor))
 
     global mqtt_wa
     mqtt_wa = MQTTWindowActuator(
@@ -156,12 +406,26 @@ def main():
         port=config.mqtt_port,
         user=config.mqtt_user,
         password=config.mqtt_password,
-        servo=servo,
-        client_name=config.device_name
+        servos=servos,
+        client_name=config.device_name,
+        groups=tuple(config.mqtt_groups),
+        group_jitter_ms=config.group_jitter_ms
     )
 
-    asyncio.create_task(mqtt_wa.run())
+    # one control task for all servos
+    asyncio.create_task(Servo.run_group(tuple(servo for _, servo in servos), config.control_period_ms))
+    startup.mark('servo')
+    web_server.max_connections = config.http_max_connections
+    web_server.max_websockets = config.http_max_websockets
+    web_server.max_header_b = config.http_max_header_b
+    web_server.set_max_body(config.http_max_body_b)
+    web_server.timeout_ms = config.http_timeout_ms
     asyncio.create_task(web_server.start_server(port=80, debug=True))
+    startup.mark('web')
+    asyncio.create_task(_network(status_led))
+    asyncio.create_task(diag.run())
+    if trace.ENABLED and config.trace_on_stall:
+        asyncio.create_task(trace.run([(name, servo.trace) for name, servo in servos]))
 
 
 if __name__ == '__main__':
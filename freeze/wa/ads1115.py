@@ -0,0 +1,81 @@
+import time
+
+
+class ADS1115:
+    # """
+    # TI ADS1115 16-bit I2C ADC. Single-shot conversions of single-ended inputs.
+    # """
+
+    _REG_CONVERSION = 0
+    _REG_CONFIG = 1
+    _OS = 0x8000  # start conversion, reads 1 when idle
+    _MUX_SINGLE = 0x4000  # AINx against GND, input number in bits 12-13
+    _PGA_4V = 0x0200  # +-4.096 V full scale, fits 3.3 V potentiometer
+    _MODE_SINGLE = 0x0100
+    _DR_860 = 0x00E0  # 860 samples per second, ~1.2 ms conversion
+    _COMP_OFF = 0x0003
+    CONVERSION_US = 1200
+    READY_POLLS = 10  # conversion ready checks, CONVERSION_US / 4 apart, before the device is taken as lost
+
+    def __init__(self, i2c, address: int = 0x48):
+        # """
+        # :param i2c: I2C bus
+        # :param address: device address, 0x48-0x4B depending on ADDR pin
+        # """
+        self._i2c = i2c
+        self._address = address
+        self._buf = bytearray(2)  # preallocated, readings don't allocate
+
+    def read_u16(self, channel: int) -> int:
+        # """
+        # Convert input voltage. Blocks for conversion time.
+
+        # :param channel: input number [0-3]
+        # :return: [0-65535], negative voltages read as 0
+        # :raise OSError: device doesn't respond or conversion isn't ready in a few ms
+        # """
+        buf = self._buf
+        cfg = (self._OS | self._MUX_SINGLE | channel << 12 | self._PGA_4V | self._MODE_SINGLE
+               | self._DR_860 | self._COMP_OFF)
+        buf[0] = cfg >> 8
+        buf[1] = cfg & 0xFF
+        self._i2c.writeto_mem(self._address, self._REG_CONFIG, buf)
+
+        time.sleep_us(self.CONVERSION_US)
+        for _ in range(self.READY_POLLS):
+            self._i2c.readfrom_mem_into(self._address, self._REG_CONFIG, buf)
+            if buf[0] & 0x80:
+                break
+            time.sleep_us(self.CONVERSION_US >> 2)
+        else:
+            raise OSError('ADS1115 conversion timeout')
+
+        self._i2c.readfrom_mem_into(self._address, self._REG_CONVERSION, buf)
+        val = buf[0] << 8 | buf[1]
+        if val & 0x8000:
+            return 0
+        return val << 1
+
+    def channel(self, channel: int) -> 'ADS1115Input':
+        # """
+        # Position source reading one input
+        # """
+        return ADS1115Input(self, channel)
+
+
+class ADS1115Input:
+    # """
+    # Single ADS1115 input with machine.ADC-like interface
+    # """
+
+    def __init__(self, adc: ADS1115, channel: int):
+        # """
+        # :param adc: converter
+        # :param channel: input number [0-3]
+        # """
+        assert 0 <= channel <= 3
+        self._adc = adc
+        self._channel = channel
+
+    def read_u16(self) -> int:
+        return self._adc.read_u16(self._channel)
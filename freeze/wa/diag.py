@@ -0,0 +1,352 @@
+import asyncio
+import gc
+import time
+from array import array
+
+
+ENABLED = True  # subsystems allocation metering, costs two gc.mem_alloc() calls per metered call
+TIMING = True  # latency histograms, cost a ticks_us() pair and a bucket increment per event
+SAMPLE_PERIOD_S = 30
+MAX_BLOCK_PROBE_STEP = 64  # largest free block search resolution, bytes
+MAX_BLOCK_PROBES = 8  # trial allocations limit, each failed one costs a full collection on MicroPython
+MAX_BLOCK_PROBE_PERIOD_S = 30  # minimum interval between probes, scrapes in between reuse last result
+
+
+class Meter:
+    # """
+    # Heap allocations of a subsystem: gc.mem_alloc() deltas over its synchronous sections
+    # """
+
+    def __init__(self, name: str):
+        # """
+        # :param name: subsystem name
+        # """
+        self.name = name
+        self.calls = 0
+        self.alloc = 0  # total bytes
+        self.max_alloc = 0  # single call high-water mark, bytes
+
+    def add(self, delta: int):
+        # """
+        # Account one call
+
+        # :param delta: allocated bytes. Negative if garbage was collected meanwhile, ignored.
+        # """
+        self.calls += 1
+        if delta > 0:
+            self.alloc += delta
+            if delta > self.max_alloc:
+                self.max_alloc = delta
+
+
+class Histogram:
+    # """
+    # Latency histogram with power of two buckets in preallocated array.
+    # Bucket i counts values below 2**i, the last one takes the rest.
+    # """
+
+    BUCKETS = 16
+    SUM_CARRY = 1 << 29  # values sum is kept in small int range, whole carries are counted apart
+
+    def __init__(self, name: str, unit: str, labels: str = ''):
+        # """
+        # :param name: metric name
+        # :param unit: value unit
+        # :param labels: Prometheus labels, e.g. 'route="/"'
+        # """
+        self.name = name
+        self.unit = unit
+        self.labels = labels
+        self.counts = array('I', bytes(4 * self.BUCKETS))
+        self.count = 0
+        self.total = 0  # values sum modulo SUM_CARRY
+        self.carries = 0
+        self.max = 0
+
+    def add(self, val: int):
+        # """
+        # Account value. No allocations for small ints.
+
+        # :param val: measured value, negative is counted as 0
+        # """
+        if val < 0:
+            val = 0
+        i = 0
+        last = self.BUCKETS - 1
+        while val >> i and i < last:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += val
+        if self.total >= self.SUM_CARRY:
+            self.total -= self.SUM_CARRY
+            self.carries += 1
+        if val > self.max:
+            self.max = val
+
+    @property
+    def sum(self) -> int:
+        # """
+        # Sum of all values
+        # """
+        return self.carries * self.SUM_CARRY + self.total
+
+    @property
+    def key(self) -> str:
+        # """
+        # Flat metric name, label values appended, e.g. http_request_route_/window.html
+        # """
+        if not self.labels:
+            return self.name
+        return self.name + '_' + self.labels.replace('"', '').replace('=', '_').replace(',', '_')
+
+    @staticmethod
+    def bound(i: int) -> int:
+        # """
+        # Bucket i upper bound, inclusive
+        # """
+        return (1 << i) - 1
+
+    def percentile(self, p: int) -> int:
+        # """
+        # Percentile estimate, upper bound of its bucket
+
+        # :param p: percentile [0-100]
+        # """
+        rank = (self.count * p + 99) // 100
+        acc = 0
+        for i in range(self.BUCKETS - 1):
+            acc += self.counts[i]
+            if acc >= rank:
+                return self.bound(i)
+        return self.max
+
+
+meters = {}  # name -> Meter
+histograms = {}  # 'name{labels}' -> Histogram
+
+# heap state, updated by sample()
+heap = {
+    'free': 0,
+    'min_free': 0,  # low-water mark
+    'max_block': 0,  # updated by largest_free_block() on demand only
+    'gc_count': 0,
+    'gc_pause_us': 0,  # last collection
+    'gc_max_pause_us': 0,
+}
+
+
+def meter(name: str) -> Meter:
+    # """
+    # Get subsystem meter, create if needed
+    # """
+    m = meters.get(name)
+    if m is None:
+        m = meters[name] = Meter(name)
+    return m
+
+
+def metered(name: str):
+    # """
+    # Decorator accounting function allocations to subsystem. No-op if metering is disabled.
+
+    # :param name: subsystem name
+    # """
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        m = meter(name)
+
+        def wrapper(*args, **kwargs):
+            before = gc.mem_alloc()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                m.add(gc.mem_alloc() - before)
+
+        return wrapper
+
+    return decorator
+
+
+def histogram(name: str, unit: str = 'us', labels: str = '') -> Histogram:
+    # """
+    # Get histogram, create if needed
+    # """
+    key = f'{name}{{{labels}}}'
+    h = histograms.get(key)
+    if h is None:
+        h = histograms[key] = Histogram(name, unit, labels)
+    return h
+
+
+def timed(name: str):
+    # """
+    # Decorator accounting function duration to histogram, us. No-op if timing is disabled.
+
+    # :param name: histogram name
+    # """
+    def decorator(func):
+        if not TIMING:
+            return func
+
+        h = histogram(name)
+
+        def wrapper(*args, **kwargs):
+            start = time.ticks_us()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                h.add(time.ticks_diff(time.ticks_us(), start))
+
+        return wrapper
+
+    return decorator
+
+
+def metered_iter(name: str, it, alloc: int = 0):
+    # """
+    # Account allocations made while iterating, e.g. template rendering streamed to socket.
+    # Time spent by consumer between items isn't counted.
+
+    # :param name: subsystem name
+    # :param it: iterator
+    # :param alloc: bytes allocated to set the iteration up, accounted as the same call
+    # :return: iterator yielding the same items
+    # """
+    if not ENABLED:
+        return it
+
+    return _metered_iter(meter(name), it, max(0, alloc))
+
+
+def _metered_iter(m: Meter, it, total: int):
+    try:
+        while True:
+            before = gc.mem_alloc()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                delta = gc.mem_alloc() - before
+                if delta > 0:
+                    total += delta
+            yield item
+    finally:
+        m.add(total)
+
+
+def collect():
+    # """
+    # Timed garbage collection
+    # """
+    start = time.ticks_us()
+    gc.collect()
+    pause = time.ticks_diff(time.ticks_us(), start)
+
+    heap['gc_count'] += 1
+    heap['gc_pause_us'] = pause
+    if pause > heap['gc_max_pause_us']:
+        heap['gc_max_pause_us'] = pause
+
+
+_max_block_ms = None  # ticks_ms() of last largest free block probe
+
+
+def largest_free_block() -> int:
+    # """
+    # Largest allocatable block, found by trial allocations. Fragmentation shows as
+    # large free heap with small largest block. Blocking and costly, so it's called on request
+    # (/metrics route), not by periodic sampling, and at most once per MAX_BLOCK_PROBE_PERIOD_S.
+    # Result is lower bound, resolution is limited by probes count.
+    # """
+    global _max_block_ms
+    now = time.ticks_ms()
+    if _max_block_ms is not None and time.ticks_diff(now, _max_block_ms) < MAX_BLOCK_PROBE_PERIOD_S * 1000:
+        return heap['max_block']
+
+    lo = 0
+    hi = gc.mem_free()
+    for _ in range(MAX_BLOCK_PROBES):
+        if hi - lo <= MAX_BLOCK_PROBE_STEP:
+            break
+        mid = (lo + hi) // 2
+        try:
+            buf = bytearray(mid)
+            del buf
+            lo = mid
+        except MemoryError:
+            hi = mid
+
+    heap['max_block'] = lo
+    _max_block_ms = now
+    return lo
+
+
+def sample():
+    # """
+    # Collect garbage and measure heap
+    # """
+    collect()
+    free = gc.mem_free()
+    heap['free'] = free
+    if not heap['min_free'] or free < heap['min_free']:
+        heap['min_free'] = free
+
+
+async def run(period_s: int = SAMPLE_PERIOD_S):
+    # """
+    # Heap sampling task
+    # """
+    while True:
+        sample()
+        await asyncio.sleep(period_s)
+
+
+def metrics(latency: bool = True) -> dict:
+    # """
+    # Flat metrics dictionary: heap state, per subsystem allocations and latency summaries
+
+    # :param latency: include histograms count, median, 95th percentile and maximum
+    # """
+    res = {'heap_' + key: val for key, val in heap.items()}
+    for m in meters.values():
+        res[f'{m.name}_calls'] = m.calls
+        res[f'{m.name}_alloc'] = m.alloc
+        res[f'{m.name}_max_alloc'] = m.max_alloc
+    if not latency:
+        return res
+
+    for h in histograms.values():
+        key = h.key
+        res[f'{key}_count'] = h.count
+        res[f'{key}_p50_{h.unit}'] = h.percentile(50)
+        res[f'{key}_p95_{h.unit}'] = h.percentile(95)
+        res[f'{key}_max_{h.unit}'] = h.max
+    return res
+
+
+def prometheus() -> str:
+    # """
+    # Metrics in Prometheus text exposition format, histograms with all buckets
+    # """
+    lines = [f'wa_{key} {val}' for key, val in metrics(latency=False).items()]
+    typed = set()
+    for h in histograms.values():
+        name = f'wa_{h.name}_{h.unit}'
+        if name not in typed:
+            typed.add(name)
+            lines.append(f'# TYPE {name} histogram')
+        sep = ',' if h.labels else ''
+        acc = 0
+        for i in range(h.BUCKETS - 1):
+            acc += h.counts[i]
+            lines.append(f'{name}_bucket{{{h.labels}{sep}le="{h.bound(i)}"}} {acc}')
+        lines.append(f'{name}_bucket{{{h.labels}{sep}le="+Inf"}} {h.count}')
+        labels = f'{{{h.labels}}}' if h.labels else ''
+        lines.append(f'{name}_sum{labels} {h.sum}')
+        lines.append(f'{name}_count{labels} {h.count}')
+    lines.append('')
+    return '\n'.join(lines)
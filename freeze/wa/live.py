@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+from microdot.websocket import WebSocket, WebSocketError
+
+from wa.mqtt import MQTTWindowActuator, WindowCover
+
+
+LIVE_PERIOD_MS = 250  # state push rate limit
+
+
+def _state(window: WindowCover) -> str:
+    # """
+    # Servo state message. Positions are in percents, target is null when stopped.
+    # """
+    servo = window.servo
+    target = servo.target
+    return json.dumps({
+        'window': window.name,
+        'pos': round(servo.position * 100),
+        'target': None if target is None else round(target * 100),
+        'running': servo.running,
+        'stalled': servo.stalled
+    })
+
+
+async def _receive_commands(ws: WebSocket, actuator: MQTTWindowActuator):
+    # """
+    # Apply commands from the page: {"pos": <percent>} or {"cmd": "stop"}, with optional
+    # "window": <name>, the first window by default. Returns when connection is closed.
+    # """
+    while True:
+        try:
+            msg = await ws.receive()
+        except (WebSocketError, OSError):
+            return
+
+        try:
+            cmd = json.loads(msg)
+            window = actuator.window(cmd.get('window'))
+            if 'pos' in cmd:
+                position = WindowCover.parse_position(cmd['pos'])
+                if position is None:
+                    raise ValueError
+                window.position = position
+            elif cmd.get('cmd') == 'stop':
+                window.stop()
+        except Exception:  # bad payload must not end the session
+            print(f'Invalid live command: {msg}')
+
+
+async def stream(ws: WebSocket, actuator: MQTTWindowActuator, period_ms: int = LIVE_PERIOD_MS):
+    # """
+    # Push servos state to the page and take its commands over one WebSocket connection.
+    # State of every window is checked once per period and sent only when changed.
+
+    # :param ws: WebSocket connection
+    # :param actuator: window actuator
+    # :param period_ms: state push period, ms
+    # """
+    receiver = asyncio.create_task(_receive_commands(ws, actuator))
+    sent = {}  # window name -> last state message
+    try:
+        while not receiver.done():
+            for window in actuator.windows:
+                state = _state(window)
+                if state != sent.get(window.name):
+                    await ws.send(state)
+                    sent[window.name] = state
+            await asyncio.sleep_ms(period_ms)
+    except OSError:
+        pass  # page closed
+    finally:
+        receiver.cancel()
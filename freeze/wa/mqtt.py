@@ -1,155 +1,197 @@
 import asyncio
+import hashlib
 import json
+import random
 import time
-import umqtt.simple
+import ubinascii
 
+from wa import diag
+from wa.mqtt_client import MQTTClient
 from wa.servo import Servo
 from wa.utils import wifi_mac
 
 
-class MQTTWindowActuator:
+class WindowCover:
     # """
-    # Home Assistant MQTT window actuator device
+    # Home Assistant cover entity of one window with its stale detector binary sensor
     # """
 
-    _WINDOW_DEV = 'window'
+    FIRST_NAME = 'window'  # name of the first window, its topics and entities predate multi-window support
     _STALE_DETECTOR_DEV = 'stale_detector'
-    _STATE_UPDATE_INTERVAL_S = 20 * 60  # 20 min
+    _POSITION_REPORT_STEP = 0.02  # minimal reported position change
 
-    def __init__(self, server: str, port: int, user: str, password: str, servo: Servo, client_name: str):
+    def __init__(self, name: str, servo: Servo, client_name: str, publish):
         # """
-        # :param server: server address
-        # :param port: server port
-        # :param user: user
-        # :param password: password
+        # :param name: window name, unique on the device
         # :param servo: window servomotor
-        # :param client_name: MQTT client name
+        # :param client_name: MQTT client name, prefix of topics and entity IDs
+        # :param publish: device state publisher, publish(topic, msg, force)
         # """
+        self.name = name
         self._servo = servo
+        self._publish = publish
         self._position: float = None
         self._stalled = False
+        self._reported_pos = 0.
 
-        mac = wifi_mac()
-        device = {
-            'model': 'WA1',
-            'manufacturer': 'dIcEmAN',
-            'name': 'Window',
-            'identifiers': mac
-        }
-        self._devices = {
-            self._WINDOW_DEV: {
-                'device_class': 'window',
-                'unit_of_measurement': '%',
-                'expire_after': self._STATE_UPDATE_INTERVAL_S * 3
-            },
-            self._STALE_DETECTOR_DEV: {
-                'device_class': 'problem',
-                'expire_after': self._STATE_UPDATE_INTERVAL_S * 3
-            }
-        }
-        self._mqtt = umqtt.simple.MQTTClient(
-            client_id=client_name,
-            server=server,
-            port=port,
-            user=user,
-            password=password
-        )
-        self._mqtt.set_callback(self._inbox)
-        self._connect()
+        self._stale_name = self._STALE_DETECTOR_DEV if name == self.FIRST_NAME else f'{name}_{self._STALE_DETECTOR_DEV}'
+        self._uid = f'{client_name}_{name}'
+        self._stale_uid = f'{client_name}_{self._stale_name}'
 
-        for dev_name, sensor_info in self._devices.items():
-            uid = f'{client_name}_{dev_name}'
-            topic_base = f'Household/window/{uid}'
+        topic_base = f'Household/window/{client_name}_'
+        self.command_topic = (topic_base + name + '/state/set').encode()
+        self.set_position_topic = (topic_base + name + '/position/set').encode()
+        self._position_topic = (topic_base + name + '/position/notify').encode()
+        self._state_topic = (topic_base + name + '/state/notify').encode()
+        self._stale_topic = (topic_base + self._stale_name + '/stale/notify').encode()
 
-            sensor_info['name'] = dev_name
-            sensor_info['unique_id'] = uid
-            sensor_info['device'] = device
+        self._retrieve_current_position()
 
-            if dev_name == self._WINDOW_DEV:
-                platform = 'cover'
-                sensor_info['command_topic'] = topic_base + '/state/set'
-                sensor_info['set_position_topic'] = topic_base + '/position/set'
-                sensor_info['position_topic'] = topic_base + '/position/notify'
+    def discovery(self, device: dict, expire_after: int):
+        # """
+        # HA MQTT discovery messages
 
-            elif dev_name == self._STALE_DETECTOR_DEV:
-                platform = 'binary_sensor'
-                sensor_info['state_topic'] = topic_base + '/stale/notify'
+        # :param device: HA device description
+        # :param expire_after: state expiration, s
+        # :return: generator of (topic, payload)
+        # """
+        yield f'homeassistant/cover/{self._uid}/config', json.dumps({
+            'device_class': 'window',
+            'unit_of_measurement': '%',
+            'command_topic': self.command_topic.decode(),
+            'set_position_topic': self.set_position_topic.decode(),
+            'position_topic': self._position_topic.decode(),
+            'state_topic': self._state_topic.decode(),
+            'expire_after': expire_after,
+            'name': self.name,
+            'unique_id': self._uid,
+            'device': device
+        })
+        yield f'homeassistant/binary_sensor/{self._stale_uid}/config', json.dumps({
+            'device_class': 'problem',
+            'state_topic': self._stale_topic.decode(),
+            'expire_after': expire_after,
+            'name': self._stale_name,
+            'unique_id': self._stale_uid,
+            'device': device
+        })
+
+    def command(self, topic: bytes, msg: bytes) -> bool:
+        # """
+        # Process incoming command
 
-            # HA MQTT discovery
-            ha_discovery_topic = f'homeassistant/{platform}/{uid}/config'
-            self._mqtt.publish(ha_discovery_topic, json.dumps(sensor_info), True)
+        # :param topic: MQTT topic
+        # :param msg: message body
+        # :return: topic belongs to this window
+        # """
+        if topic == self.command_topic:
+            self.state_command(msg)
 
-            # command subscriptions
-            for set_topic in ('command_topic', 'set_position_topic'):
-                if set_topic in sensor_info:
-                    self._mqtt.subscribe(sensor_info[set_topic])
+        elif topic == self.set_position_topic:
+            self.position_command(msg)
 
-        self._retrieve_current_position()
-        self.send_update()
+        else:
+            return False
 
-    def _retrieve_current_position(self):
+        return True
+
+    def state_command(self, msg: bytes):
         # """
-        # Current position is servo position
+        # HA cover command
+
+        # :param msg: OPEN, CLOSE or STOP
         # """
-        self._position = self._servo.position
+        if msg == b'OPEN':
+            self.position = 1
 
-    def _connect(self):
-        self._mqtt.connect()
+        elif msg == b'CLOSE':
+            self.position = 0
 
-    def send_update(self):
+        elif msg == b'STOP':
+            self.stop()
+
+    def position_command(self, msg: bytes):
         # """
-        # Send parameters update to MQTT server
+        # HA cover set position command. Malformed one is dropped.
+
+        # :param msg: position, percents
         # """
-        state = ('OFF', 'ON')[self._stalled]
-        self._mqtt.publish(self._devices[self._STALE_DETECTOR_DEV]['state_topic'], state)
+        new_position = self.parse_position(msg)
+        if new_position is None:
+            print(f'Invalid position command: {msg}')
+            return
 
-        pos = str(self._position * 100)
-        self._mqtt.publish(self._devices[self._WINDOW_DEV]['position_topic'], pos)
+        self.position = new_position
 
-        self.last_update = time.time()
+    @staticmethod
+    def parse_position(msg: bytes):
+        # """
+        # Set position command payload
 
-    async def run(self):
+        # :param msg: position, percents
+        # :return: position [0-1], None if message is malformed or out of range
         # """
-        # Main event loop
+        try:
+            position = float(msg) / 100
+        except (ValueError, TypeError):
+            return None
+
+        return position if 0 <= position <= 1 else None
+
+    def _retrieve_current_position(self):
+        # """
+        # Current position is servo position
         # """
+        self._position = self._servo.position
 
-        while True:
-            self._mqtt.check_msg()
-            self._set_stalled(self._servo.stalled)
+    def _motion_state(self, pos: float) -> str:
+        # """
+        # HA cover state: opening, closing or stopped
 
-            self._servo.tick()
+        # :param pos: actual servo position
+        # """
+        target = self._servo.target
+        if target is None:
+            # motor runs without target while calibration drives it
+            return ('stopped', 'opening', 'closing')[self._servo.direction]
 
-            if time.time() - self.last_update > self._STATE_UPDATE_INTERVAL_S:
-                self.send_update()
+        if not self._servo.running and abs(target - pos) < Servo.POSITION_PRECISION:
+            return 'stopped'
 
-            idle = 0.1 if self._servo.running else 0.5
-            await asyncio.sleep(idle)
+        return 'opening' if target > pos else 'closing'
 
-    def _inbox(self, topic: bytes, msg: bytes):
+    def report(self, force: bool = False):
         # """
-        # MQTT incoming commands processing
+        # Publish changed state. Actual position is reported once it moves by a report step,
+        # or when the window starts or stops moving.
 
-        # :param topic: MQTT topic
-        # :param msg: message body
+        # :param force: publish all state topics
         # """
-        top = topic.decode()
+        self._publish(self._stale_topic, ('OFF', 'ON')[self._stalled], force)
 
-        if top == self._devices[self._WINDOW_DEV]['command_topic']:
-            if msg == b'OPEN':
-                self.position = 1
+        pos = self._servo.position
+        state = self._motion_state(pos)
+        state_changed = self._publish(self._state_topic, state, force)
 
-            elif msg == b'CLOSE':
-                self.position = 0
+        if force or state_changed or abs(pos - self._reported_pos) >= self._POSITION_REPORT_STEP:
+            self._reported_pos = pos
+            self._publish(self._position_topic, str(round(pos * 100)), force)
 
-            elif msg == b'STOP':
-                self._servo.stop()
-                self._stalled = False
-                self._retrieve_current_position()
-                self.send_update()
+    @property
+    def servo(self) -> Servo:
+        # """
+        # Window servomotor
+        # """
+        return self._servo
 
-        if top == self._devices[self._WINDOW_DEV]['set_position_topic']:
-            new_position = float(msg) / 100
-            self.position = new_position
+    def stop(self):
+        # """
+        # Stop window movement
+        # """
+        self._servo.stop()
+        self._stalled = False
+        self._retrieve_current_position()
+        self.report()
 
     @property
     def position(self) -> float:
@@ -171,11 +213,11 @@ class MQTTWindowActuator:
         if position == self._position:
             return
 
-        self._servo.position = self._position = position
+        # coalesced by servo, new state is reported once applied
+        self._servo.request(position)
+        self._position = position
 
-        self.send_update()
-
-    def _set_stalled(self, stalled: bool):
+    def set_stalled(self, stalled: bool):
         # """
         # Change stale status
 
@@ -188,4 +230,298 @@ class MQTTWindowActuator:
         if stalled:
             self._retrieve_current_position()
 
-        self.send_update()
+        self.report()
+
+
+class MQTTWindowActuator:
+    # """
+    # Home Assistant MQTT window actuator device. Windows share one MQTT connection.
+    # """
+
+    _STATE_UPDATE_INTERVAL_S = 20 * 60  # 20 min
+    _POLL_INTERVAL_S = 0.5  # servo state check interval, bounds in-motion reports rate
+    _DIAG_INTERVAL_S = 60  # heap diagnostics publishing interval
+    _DIAG_SENSORS = (
+        ('heap_free', 'B'),
+        ('heap_min_free', 'B'),
+        ('heap_max_block', 'B'),
+        ('heap_gc_max_pause_us', 'µs'),
+    )
+    _HA_STATUS_TOPIC = b'homeassistant/status'  # HA birth and last will messages
+    GROUP_TOPIC_BASE = 'Household/window/group/'  # + '<group>/state/set' or '<group>/position/set'
+    _DISCOVERY_HASHES_PATH = 'discovery.json'  # hashes of discovery payloads retained by broker
+
+    def __init__(self, server: str, port: int, user: str, password: str, servos: list, client_name: str,
+                 groups: tuple = (), group_jitter_ms: int = 0):
+        # """
+        # :param server: server address
+        # :param port: server port
+        # :param user: user
+        # :param password: password
+        # :param servos: (window name, window servomotor) pairs, the first window is the default one
+        # :param client_name: MQTT client name
+        # :param groups: names of groups whose commands move all windows of the device
+        # :param group_jitter_ms: group commands are executed after random delay up to this, so the fleet
+        #     doesn't start all motors at once
+        # """
+        self._client_name = client_name
+        self._sent = {}  # last message sent to each state topic
+        self.windows = tuple(
+            WindowCover(name, servo, client_name, self._publish) for name, servo in servos
+        )
+        self._applied = asyncio.Event()  # servo took new target, report at once
+        for window in self.windows:
+            window.servo.applied = self._applied
+
+        self._group_command_topics = tuple(f'{self.GROUP_TOPIC_BASE}{g}/state/set'.encode() for g in groups)
+        self._group_position_topics = tuple(f'{self.GROUP_TOPIC_BASE}{g}/position/set'.encode() for g in groups)
+        self._group_jitter_ms = group_jitter_ms
+        self._group_task = None
+
+        # only topics stay resident, discovery payloads are rebuilt when needed
+        self._diag_topic = f'Household/window/{client_name}_diagnostics/notify'.encode()
+        self._last_diag = time.time()
+
+        self._mqtt = MQTTClient(
+            client_id=client_name,
+            server=server,
+            port=port,
+            user=user,
+            password=password
+        )
+        self._mqtt.set_callback(self._inbox)
+        self._mqtt.set_connect_callback(self.send_update)  # broker may have lost retained state
+        for window in self.windows:
+            self._mqtt.subscribe(window.command_topic)
+            self._mqtt.subscribe(window.set_position_topic)
+        for topic in self._group_command_topics + self._group_position_topics:
+            self._mqtt.subscribe(topic)
+        self._mqtt.subscribe(self._HA_STATUS_TOPIC)
+
+        try:
+            with open(self._DISCOVERY_HASHES_PATH, encoding='utf8') as f:
+                self._discovery_hashes = json.load(f)
+        except (OSError, ValueError):
+            self._discovery_hashes = {}
+        self._hashes_saved = True
+        self._discovery_dropped = 0  # queue drops count when discovery was queued
+        self._publish_discovery()
+
+        self.last_update = time.time()  # state is sent once connected
+
+    def _discovery(self):
+        # """
+        # HA MQTT discovery messages
+
+        # :return: generator of (topic, payload)
+        # """
+        device = {
+            'model': 'WA1',
+            'manufacturer': 'dIcEmAN',
+            'name': 'Window',
+            'identifiers': wifi_mac()
+        }
+        for window in self.windows:
+            yield from window.discovery(device, self._STATE_UPDATE_INTERVAL_S * 3)
+
+        # heap diagnostics from one JSON message, all metrics are attributes of free heap sensor
+        for name, unit in self._DIAG_SENSORS:
+            uid = f'{self._client_name}_{name}'
+            sensor_info = {
+                'entity_category': 'diagnostic',
+                'state_class': 'measurement',
+                'unit_of_measurement': unit,
+                'state_topic': self._diag_topic.decode(),
+                'value_template': '{{ value_json.%s }}' % name,
+                'name': name,
+                'unique_id': uid,
+                'device': device
+            }
+            if name == 'heap_free':
+                sensor_info['json_attributes_topic'] = self._diag_topic.decode()
+
+            yield f'homeassistant/sensor/{uid}/config', json.dumps(sensor_info)
+
+    def _publish_discovery(self, force: bool = False):
+        # """
+        # Queue retained HA MQTT discovery messages which changed since they were last published
+
+        # :param force: publish all, e.g. broker or HA may not have them
+        # """
+        hashes = self._discovery_hashes
+        self._discovery_dropped = self._mqtt.dropped
+        for topic, payload in self._discovery():
+            digest = ubinascii.hexlify(hashlib.sha256(payload.encode()).digest()[:8]).decode()
+            if not force and hashes.get(topic) == digest:
+                continue
+
+            hashes[topic] = digest
+            self._hashes_saved = False
+            self._mqtt.publish(topic, payload, True)
+
+    def _save_discovery_hashes(self):
+        # """
+        # Remember published discovery, once it is actually sent
+        # """
+        with open(self._DISCOVERY_HASHES_PATH, 'w', encoding='utf8') as f:
+            json.dump(self._discovery_hashes, f)
+        self._hashes_saved = True
+
+    def reconfigure(self, server: str, port: int, user: str, password: str):
+        # """
+        # Switch to another MQTT server or credentials without restart
+
+        # :param server: server address
+        # :param port: server port
+        # :param user: user
+        # :param password: password
+        # """
+        self._mqtt.reconfigure(server=server, port=port, user=user, password=password)
+        self._publish_discovery(force=True)  # new server may not have retained discovery
+
+    def _publish(self, topic: bytes, msg: str, force: bool) -> bool:
+        # """
+        # Publish state message unless it was already sent
+
+        # :param topic: state topic
+        # :param msg: message body
+        # :param force: publish even if unchanged
+        # :return: message differs from the last one sent
+        # """
+        changed = self._sent.get(topic) != msg
+        if not force and not changed:
+            return False
+
+        self._sent[topic] = msg
+        self._mqtt.publish(topic, msg)
+        return changed
+
+    @diag.timed('send_update')
+    def send_update(self):
+        # """
+        # Send full state to MQTT server
+        # """
+        for window in self.windows:
+            window.report(force=True)
+        self.last_update = time.time()
+
+    async def run(self):
+        # """
+        # Main event loop
+        # """
+        asyncio.create_task(self._mqtt.run())
+
+        while True:
+            self._applied.clear()
+            for window in self.windows:
+                window.set_stalled(window.servo.stalled)
+
+            if time.time() - self.last_update > self._STATE_UPDATE_INTERVAL_S:
+                self.send_update()
+            elif self._mqtt.connected:  # full state is sent on connection
+                for window in self.windows:
+                    window.report()
+
+            if not self._hashes_saved and self._mqtt.connected and not self._mqtt.queued:
+                if self._mqtt.dropped != self._discovery_dropped:
+                    # full queue dropped messages since discovery was queued, some of it may be lost
+                    self._publish_discovery(force=True)
+                else:
+                    self._save_discovery_hashes()
+
+            if self._mqtt.connected and time.time() - self._last_diag >= self._DIAG_INTERVAL_S:
+                self._publish(self._diag_topic, json.dumps(diag.metrics()), False)
+                self._last_diag = time.time()
+
+            try:
+                await asyncio.wait_for(self._applied.wait(), self._POLL_INTERVAL_S)
+            except asyncio.TimeoutError:
+                pass
+
+    @diag.metered('mqtt_inbox')
+    def _inbox(self, topic: bytes, msg: bytes):
+        # """
+        # MQTT incoming commands processing
+
+        # :param topic: MQTT topic
+        # :param msg: message body
+        # """
+        for window in self.windows:
+            if window.command(topic, msg):
+                return
+
+        if topic in self._group_command_topics:
+            self._group_command(False, msg)
+
+        elif topic in self._group_position_topics:
+            self._group_command(True, msg)
+
+        elif topic == self._HA_STATUS_TOPIC and msg == b'online':
+            # HA restarted and may have lost retained discovery and state
+            self._publish_discovery(force=True)
+            self.send_update()
+
+    def _group_command(self, set_position: bool, msg: bytes):
+        # """
+        # Schedule group command execution. Pending one is replaced, the latest command wins.
+        # Malformed command is dropped and doesn't replace pending one. STOP starts no motor,
+        # so it isn't delayed by jitter.
+
+        # :param set_position: set position command, cover command otherwise
+        # :param msg: message body
+        # """
+        if set_position and WindowCover.parse_position(msg) is None:
+            print(f'Invalid group position command: {msg}')
+            return
+
+        if self._group_task:
+            self._group_task.cancel()
+            self._group_task = None
+        if not set_position and msg == b'STOP':
+            self._apply_group_command(set_position, msg)
+            return
+
+        self._group_task = asyncio.create_task(self._execute_group_command(set_position, msg))
+
+    async def _execute_group_command(self, set_position: bool, msg: bytes):
+        if self._group_jitter_ms:
+            await asyncio.sleep_ms(random.getrandbits(20) % (self._group_jitter_ms + 1))
+
+        self._group_task = None
+        self._apply_group_command(set_position, msg)
+
+    def _apply_group_command(self, set_position: bool, msg: bytes):
+        for window in self.windows:
+            if set_position:
+                window.position_command(msg)
+            else:
+                window.state_command(msg)
+
+    def window(self, name: str = None) -> WindowCover:
+        # """
+        # Window by name
+
+        # :param name: window name, the first window if None
+        # :return: None if there is no such window
+        # """
+        if name is None:
+            return self.windows[0] if self.windows else None
+
+        for window in self.windows:
+            if window.name == name:
+                return window
+        return None
+
+    @property
+    def connected(self) -> bool:
+        # """
+        # Connected to MQTT server
+        # """
+        return self._mqtt.connected
+
+    @property
+    def queued(self) -> int:
+        # """
+        # Messages waiting for sending, discovery ones included
+        # """
+        return self._mqtt.queued
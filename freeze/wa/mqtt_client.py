@@ -0,0 +1,281 @@
+import asyncio
+import random
+import struct
+import time
+
+
+class MQTTException(Exception):
+    pass
+
+
+class MQTTClient:
+    # """
+    # asyncio MQTT 3.1.1 client. QoS 0 only.
+    # Publishing never blocks: messages are queued and sent by connection task, which
+    # reconnects with exponential backoff and restores subscriptions.
+    # """
+
+    KEEPALIVE_S = 60
+    CONNECT_TIMEOUT_S = 10
+    BACKOFF_MIN_S = 1
+    BACKOFF_MAX_S = 60
+    QUEUE_SIZE = 16
+
+    def __init__(self, client_id: str, server: str, port: int = 1883, user: str = None, password: str = None,
+                 keepalive: int = KEEPALIVE_S):
+        # """
+        # :param client_id: MQTT client name
+        # :param server: server address
+        # :param port: server port
+        # :param user: user
+        # :param password: password
+        # :param keepalive: keepalive interval, s
+        # """
+        self._client_id = client_id
+        self._server = server
+        self._port = port
+        self._user = user
+        self._password = password
+        self._keepalive = keepalive
+
+        self._cb = None
+        self._connect_cb = None
+        self._subscriptions = []
+        self._queue = []  # (topic, message, retain)
+        self._sending = None  # queue head being written, stays queued until sent for resending after reconnect
+        self._pending = asyncio.Event()
+        self._reconnect = asyncio.Event()
+        self._writer = None
+        self.connected = False
+        self.dropped = 0  # messages dropped from full queue
+
+    def reconfigure(self, server: str, port: int = 1883, user: str = None, password: str = None):
+        # """
+        # Change server or credentials. Current connection is dropped and the new one is opened at once.
+
+        # :param server: server address
+        # :param port: server port
+        # :param user: user
+        # :param password: password
+        # """
+        self._server = server
+        self._port = port
+        self._user = user
+        self._password = password
+
+        self._reconnect.set()
+        if self._writer:
+            self._writer.close()  # ends session
+
+    @property
+    def queued(self) -> int:
+        # """
+        # Messages waiting for sending
+        # """
+        return len(self._queue)
+
+    def set_callback(self, f):
+        # """
+        # :param f: incoming message handler f(topic: bytes, msg: bytes)
+        # """
+        self._cb = f
+
+    def set_connect_callback(self, f):
+        # """
+        # :param f: handler called after each successful (re)connection
+        # """
+        self._connect_cb = f
+
+    def subscribe(self, topic: str):
+        # """
+        # Subscribe to topic. Subscription is restored after reconnection.
+
+        # :param topic: topic filter
+        # """
+        self._subscriptions.append(topic)
+
+    def publish(self, topic: str, msg, retain: bool = False):
+        # """
+        # Queue message for sending. The oldest message is dropped if queue is full.
+
+        # :param topic: topic
+        # :param msg: message body
+        # :param retain: retain flag
+        # """
+        queue = self._queue
+        if len(queue) >= self.QUEUE_SIZE:
+            # the oldest message waiting is dropped, not the one being sent
+            queue.pop(1 if queue[0] is self._sending and len(queue) > 1 else 0)
+            self.dropped += 1
+        queue.append((topic, msg, retain))
+        self._pending.set()
+
+    @staticmethod
+    def _str(s) -> bytes:
+        if isinstance(s, str):
+            s = s.encode()
+        return struct.pack('!H', len(s)) + s
+
+    @staticmethod
+    def _packet(header: int, *parts) -> bytearray:
+        size = 0
+        for part in parts:
+            size += len(part)
+
+        pkt = bytearray((header,))
+        while True:
+            b = size & 0x7F
+            size >>= 7
+            pkt.append(b | 0x80 if size else b)
+            if not size:
+                break
+
+        for part in parts:
+            pkt.extend(part.encode() if isinstance(part, str) else part)
+        return pkt
+
+    @staticmethod
+    async def _read_packet(reader) -> tuple:
+        header = (await reader.readexactly(1))[0]
+        size = 0
+        shift = 0
+        while True:
+            b = (await reader.readexactly(1))[0]
+            size |= (b & 0x7F) << shift
+            if not b & 0x80:
+                break
+            shift += 7
+
+        body = await reader.readexactly(size) if size else b''
+        return header, body
+
+    async def _connect(self) -> tuple:
+        # """
+        # Open connection, log in and subscribe
+
+        # :return: stream reader, stream writer
+        # """
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self._server, self._port),
+            self.CONNECT_TIMEOUT_S
+        )
+
+        flags = 0x02  # clean session
+        payload = self._str(self._client_id)
+        if self._user:
+            flags |= 0x80
+            payload += self._str(self._user)
+            if self._password:
+                flags |= 0x40
+                payload += self._str(self._password)
+
+        writer.write(self._packet(
+            0x10, b'\x00\x04MQTT\x04', bytes((flags,)), struct.pack('!H', self._keepalive), payload
+        ))
+        await writer.drain()
+
+        header, body = await asyncio.wait_for(self._read_packet(reader), self.CONNECT_TIMEOUT_S)
+        if header != 0x20 or len(body) < 2 or body[1]:
+            writer.close()
+            raise MQTTException(f'connection refused: {body[1] if len(body) > 1 else header}')
+
+        for pid, topic in enumerate(self._subscriptions, 1):
+            writer.write(self._packet(0x82, struct.pack('!H', pid), self._str(topic), b'\x00'))
+        await writer.drain()
+
+        return reader, writer
+
+    async def _sender(self, writer):
+        # """
+        # Send queued messages. Server is pinged every half of keepalive interval regardless of outgoing
+        # traffic, its answers keep the reader deadline from expiring while only publishing.
+        # """
+        ping_ms = self._keepalive * 500
+        next_ping = time.ticks_add(time.ticks_ms(), ping_ms)
+        try:
+            while True:
+                due = time.ticks_diff(next_ping, time.ticks_ms())
+                if due <= 0:
+                    writer.write(b'\xc0\x00')  # PINGREQ
+                    await writer.drain()
+                    next_ping = time.ticks_add(time.ticks_ms(), ping_ms)
+                    continue
+
+                if not self._queue:
+                    self._pending.clear()
+                    try:
+                        await asyncio.wait_for(self._pending.wait(), due / 1000)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                item = self._sending = self._queue[0]
+                topic, msg, retain = item
+                writer.write(self._packet(0x30 | retain, self._str(topic), msg))
+                await writer.drain()
+                self._sending = None
+                if self._queue and self._queue[0] is item:  # publish() may drop it from full queue meanwhile
+                    self._queue.pop(0)
+
+        except OSError:
+            writer.close()  # wakes up reader
+        finally:
+            self._sending = None
+
+    async def _session(self, reader, writer):
+        # """
+        # Process incoming packets until connection is lost
+        # """
+        sender = asyncio.create_task(self._sender(writer))
+        try:
+            while True:
+                # server answers pings, so silence longer than keepalive means dead link
+                header, body = await asyncio.wait_for(self._read_packet(reader), self._keepalive * 1.5)
+                if header & 0xF0 == 0x30:  # PUBLISH
+                    topic_len = struct.unpack('!H', body[:2])[0]
+                    pos = 2 + topic_len
+                    if header & 0x06:
+                        pos += 2  # packet identifier
+                    if self._cb:
+                        try:
+                            self._cb(body[2:2 + topic_len], body[pos:])
+                        except Exception as e:  # bad message mustn't end the session
+                            print(f'MQTT message handling error: {e!r}')
+        finally:
+            sender.cancel()
+
+    async def run(self):
+        # """
+        # Connection task
+        # """
+        backoff = self.BACKOFF_MIN_S
+        while True:
+            self._reconnect.clear()
+            writer = None
+            try:
+                reader, writer = await self._connect()
+                self._writer = writer
+                if not self._reconnect.is_set():  # not reconfigured while connecting
+                    self.connected = True
+                    backoff = self.BACKOFF_MIN_S
+                    if self._connect_cb:
+                        self._connect_cb()
+
+                    await self._session(reader, writer)
+
+            except (OSError, EOFError, MQTTException, asyncio.TimeoutError) as e:
+                print(f'MQTT connection error: {e!r}')
+
+            self.connected = False
+            self._writer = None
+            if writer:
+                writer.close()
+
+            try:
+                # reconfiguration cuts the backoff short. Random half of the delay spreads reconnections
+                # of devices which lost the server at the same moment.
+                delay = backoff * (512 + random.getrandbits(9)) / 1024
+                await asyncio.wait_for(self._reconnect.wait(), delay)
+                backoff = self.BACKOFF_MIN_S
+            except asyncio.TimeoutError:
+                backoff = min(backoff * 2, self.BACKOFF_MAX_S)
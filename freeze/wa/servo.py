@@ -1,32 +1,252 @@
+import asyncio
+import gc
+import sys
+import time
+from array import array
 from machine import Pin, ADC, PWM
 
+from wa import diag, trace
+
 
 UINT16_MAX = 65535
+POSITION_ONE = 10000  # control path positions are integers, 1/10000 of the travel
+OUTPUT_MAX = 1000  # motor output scale, per mille of power range
+SLOPE_SHIFT = 14  # fixed point of position table segment slopes, products stay in small int range
+
+
+def _isqrt(n: int, x: int) -> int:
+    # """
+    # Integer square root, Newton's method
+
+    # :param n: radicand
+    # :param x: initial guess, not less than the root
+    # """
+    if n <= 0:
+        return 0
+    y = (x + n // x) >> 1
+    while y < x:
+        x = y
+        y = (x + n // x) >> 1
+    return x
+
+
+def _median_py(ring, buf, n: int) -> int:
+    # """
+    # Median of ADC readings ring buffer. Insertion sort into scratch buffer, no allocations.
+
+    # :param ring: readings, array('H')
+    # :param buf: scratch buffer of the same length
+    # :param n: buffer length
+    # """
+    for i in range(n):
+        val = ring[i]
+        j = i
+        while j and buf[j - 1] > val:
+            buf[j] = buf[j - 1]
+            j -= 1
+        buf[j] = val
+
+    return buf[n >> 1]
+
+
+def _slope_py(times, raws, first: int, n: int, n_max: int) -> int:
+    # """
+    # Least squares slope of readings ring buffer. Caller ensures samples span some time.
+
+    # :param times: ticks_ms timestamps, array('i')
+    # :param raws: ADC readings, array('i')
+    # :param first: oldest sample index
+    # :param n: samples
+    # :param n_max: ring buffer length
+    # :return: ADC counts per second
+    # """
+    # relative values keep sums in small int range
+    t0 = times[first]
+    x0 = raws[first]
+    st = sx = stt = stx = 0
+    i = first
+    for _ in range(n):
+        t = time.ticks_diff(times[i], t0)
+        x = raws[i] - x0
+        st += t
+        sx += x
+        stt += t * t
+        stx += t * x
+        i += 1
+        if i == n_max:
+            i = 0
+
+    return (n * stx - st * sx) // ((n * stt - st * st) // 1000)  # ms -> s
+
+
+def _to_fixed_py(table, base, slopes, seg, last: int, pot: int, shift: int) -> int:
+    # """
+    # Piecewise-linear position lookup. Search starts from the last segment, position changes slowly.
+
+    # :param table: ADC readings of evenly spaced positions, array('H')
+    # :param base: segment start positions, array('i')
+    # :param slopes: segment slopes, fixed point, array('i')
+    # :param seg: last segment index, array('i') of one item, updated
+    # :param last: last segment index
+    # :param pot: ADC reading
+    # :param shift: slopes fixed point shift
+    # :return: fixed point position
+    # """
+    i = seg[0]
+    if pot < table[i]:
+        while i and pot < table[i]:
+            i -= 1
+    else:
+        while i < last and pot >= table[i + 1]:
+            i += 1
+    seg[0] = i
+
+    return base[i] + ((pot - table[i]) * slopes[i] >> shift)
+
+
+# Control loop kernels compiled to machine code on MicroPython, chosen at import.
+# Pure Python versions run on CPython (simulator) and stay importable for benchmarking.
+# Control tick methods are compiled with @micropython.native on MicroPython and stay bytecode on CPython.
+NATIVE = sys.implementation.name == 'micropython'
+SLOPE_NATIVE_MAX_SPAN_MS = 1000  # longer windows could overflow 32-bit sums of viper code
+
+if NATIVE:
+    import micropython
+
+    @micropython.viper
+    def _median(ring: ptr16, buf: ptr16, n: int) -> int:  # noqa: F821
+        for i in range(n):
+            val = ring[i]
+            j = i
+            while j > 0 and buf[j - 1] > val:
+                buf[j] = buf[j - 1]
+                j -= 1
+            buf[j] = val
+
+        return buf[n >> 1]
+
+    @micropython.viper
+    def _slope(times: ptr32, raws: ptr32, first: int, n: int, n_max: int) -> int:  # noqa: F821
+        t0 = times[first]
+        x0 = raws[first]
+        st = 0
+        sx = 0
+        stt = 0
+        stx = 0
+        i = first
+        for _ in range(n):
+            t = (times[i] - t0) & 0x3FFFFFFF  # ticks_ms wrap at 2**30
+            x = raws[i] - x0
+            st += t
+            sx += x
+            stt += t * t
+            stx += t * x
+            i += 1
+            if i == n_max:
+                i = 0
+
+        return (n * stx - st * sx) // ((n * stt - st * st) // 1000)
+
+    @micropython.viper
+    def _to_fixed(table: ptr16, base: ptr32, slopes: ptr32, seg: ptr32, last: int, pot: int,  # noqa: F821
+                  shift: int) -> int:
+        i = seg[0]
+        if pot < table[i]:
+            while i > 0 and pot < table[i]:
+                i -= 1
+        else:
+            while i < last and pot >= table[i + 1]:
+                i += 1
+        seg[0] = i
+
+        return base[i] + ((pot - table[i]) * slopes[i] >> shift)
+else:
+    _median = _median_py
+    _slope = _slope_py
+    _to_fixed = _to_fixed_py
+
+    class micropython:
+        # """
+        # Stand-in of compile-time decorators, functions stay as they are
+        # """
+
+        @staticmethod
+        def native(func):
+            return func
+
+
+class CalibrationInterrupted(ValueError):
+    pass
 
 
 class Motor:
     """
     DC motor driver TB6612FNG
     """
-    def __init__(self, cw_pin: Pin, ccw_pin: Pin, pwm_pin: Pin, status_led: Pin, power: float = 1):
+    def __init__(self, cw_pin: Pin, ccw_pin: Pin, pwm_pin: Pin, status_led: Pin, power: float = 1,
+                 min_power: float = 0):
         # """
         # :param cw_pin: pin to rotate motor CW
         # :param ccw_pin: pin to rotate motor CCW
         # :param pwm_pin: rotation power PWM pin
         # :param status_led: motor activity LED
         # :param power: rotation speed/power, [0-1]
+        # :param min_power: power needed to overcome static friction, [0-1]
         # """
-        assert 0 <= power <= 1
-        duty = round(power * UINT16_MAX)
-        self._power = PWM(pwm_pin, freq=1000, duty_u16=duty)
+        assert 0 <= min_power <= power <= 1
+        self.power = power
+        self.min_power = min_power
+        self.power_u16 = round(power * UINT16_MAX)
+        self.min_power_u16 = round(min_power * UINT16_MAX)
+        self.duty_u16 = self.power_u16  # applied power
+        self._power = PWM(pwm_pin, freq=1000, duty_u16=self.duty_u16)
 
         self._cw_pin = cw_pin
         self._ccw_pin = ccw_pin
 
         self._led = status_led
         self.running = False
+        self.direction = 0  # position change direction: -1 CW, 1 CCW, 0 stopped
         self.stop()
 
+    def set_power(self, power: float, min_power: float = 0):
+        # """
+        # Change power limits, applied to running motor at once
+
+        # :param power: rotation speed/power, [0-1]
+        # :param min_power: power needed to overcome static friction, [0-1]
+        # """
+        assert 0 <= min_power <= power <= 1
+        self.power = power
+        self.min_power = min_power
+        self.power_u16 = round(power * UINT16_MAX)
+        self.min_power_u16 = round(min_power * UINT16_MAX)
+        # on/off control runs at full power, variable output is reapplied on next drive()
+        self._set_duty(self.power_u16)
+
+    def _set_duty(self, duty_u16: int):
+        if duty_u16 != self.duty_u16:
+            self.duty_u16 = duty_u16
+            self._power.duty_u16(duty_u16)
+
+    def drive(self, output: int):
+        # """
+        # Rotate with variable power
+
+        # :param output: [-OUTPUT_MAX, OUTPUT_MAX], positive is CCW. Magnitude is mapped to [min_power, power] range.
+        # """
+        if not output:
+            self.stop()
+            return
+
+        level = min(OUTPUT_MAX, output if output > 0 else -output)
+        self._set_duty(self.min_power_u16 + level * (self.power_u16 - self.min_power_u16) // OUTPUT_MAX)
+        if output > 0:
+            if self.direction != 1:
+                self.ccw()
+        elif self.direction != -1:
+            self.cw()
+
     def cw(self):
         # """
         # Rotate clockwise
@@ -35,6 +255,7 @@ class Motor:
         self._cw_pin.on()
         self._led.on()
         self.running = True
+        self.direction = -1
 
     def ccw(self):
         # """
@@ -44,6 +265,7 @@ class Motor:
         self._ccw_pin.on()
         self._led.on()
         self.running = True
+        self.direction = 1
 
     def stop(self):
         # """
@@ -53,6 +275,7 @@ class Motor:
         self._ccw_pin.off()
         self._led.off()
         self.running = False
+        self.direction = 0
 
 
 class PositionSensor:
@@ -60,24 +283,147 @@ class PositionSensor:
     # Gearbox axis absolute position sensor. Based on potentiometer.
     # """
 
-    def __init__(self, pos_min: float = 0., pos_max: float = 1.):
+    FILTER_NONE = 0  # single ADC sample
+    FILTER_MEDIAN = 1  # median of ring buffer
+    FILTER_EMA = 2  # exponential moving average
+
+    def __init__(self, pos_min: float = 0., pos_max: float = 1., filter_type: int = FILTER_NONE,
+                 samples: int = 1, burst: int = None, ema_shift: int = 3, source=None):
         # """
         # :param pos_min: potentiometer relative ADC value of a low end position limit [0-1]
         # :param pos_max: potentiometer relative ADC value of a high end position limit [0-1]
+        # :param filter_type: ADC readings filter
+        # :param samples: ring buffer length, median window
+        # :param burst: ADC samples taken per reading, whole ring buffer by default
+        # :param ema_shift: EMA smoothing factor is 1 / 2**ema_shift
+        # :param source: potentiometer voltage reader with read_u16() method, e.g. external ADC input.
+        #     Built-in ADC by default.
         # """
-        self._adc_min = round(pos_min * UINT16_MAX)
-        self._adc_max = round(pos_max * UINT16_MAX)
-        self._adc = ADC(0)
+        self.set_bounds(pos_min, pos_max)
+        self._adc = source or ADC(0)
+
+        self._filter = filter_type
+        self._burst = burst or samples
+        self._ema_shift = ema_shift
+
+        # preallocated buffers, filled with initial readings
+        self._ring = array('H', bytes(2 * samples))
+        self._head = 0
+        self._sorted = array('H', self._ring)
+        self._ema_acc = 0
+        self._primed = False
+        try:
+            self._prime()
+        except OSError:
+            pass  # e.g. external ADC is missing: readings fail until it answers
+
+    def _prime(self):
+        # """
+        # Fill filter buffers with readings
+        # """
+        ring = self._ring
+        for i in range(len(ring)):
+            ring[i] = self._adc.read_u16()
+        self._ema_acc = ring[0] << self._ema_shift
+        self._primed = True
+
+    def set_bounds(self, pos_min: float, pos_max: float):
+        # """
+        # Change position limits
+
+        # :param pos_min: potentiometer relative ADC value of a low end position limit [0-1]
+        # :param pos_max: potentiometer relative ADC value of a high end position limit [0-1]
+        # """
+        self.set_table((round(pos_min * UINT16_MAX), round(pos_max * UINT16_MAX)))
+
+    def set_table(self, table: list):
+        # """
+        # Change position mapping to piecewise-linear one, e.g. measured by calibration.
+        # Linear bounds are the two points table.
+
+        # :param table: ADC readings [0-65535] of evenly spaced positions from 0 to 1, strictly increasing
+        # """
+        n = len(table)
+        if n < 2 or any(table[i] >= table[i + 1] for i in range(n - 1)):
+            raise ValueError(f'Position table must increase: {table}')
+
+        self._table = array('H', table)
+        # segment start positions and slope reciprocals, readings are converted without division
+        self._base = array('i', (i * POSITION_ONE // (n - 1) for i in range(n)))
+        self._seg_slope = array('i', (
+            ((self._base[i + 1] - self._base[i]) << SLOPE_SHIFT) // (table[i + 1] - table[i])
+            for i in range(n - 1)
+        ))
+        self._seg = array('i', (0,))  # segment of the last reading
+        self._last_seg = n - 2
+        self._min = table[0]
+        self._max = table[-1]
+
+    @property
+    def table(self) -> list:
+        # """
+        # Position mapping, ADC readings of evenly spaced positions from 0 to 1
+        # """
+        return list(self._table)
+
+    @property
+    @micropython.native
+    def raw(self) -> int:
+        # """
+        # Filtered ADC reading [0-65535]
+        # """
+        if self._filter == self.FILTER_NONE:
+            return self._adc.read_u16()
+        if not self._primed:
+            self._prime()
+
+        adc = self._adc
+        ring = self._ring
+        n = len(ring)
+        head = self._head
+        ema = self._filter == self.FILTER_EMA
+        acc = self._ema_acc
+        shift = self._ema_shift
+
+        for _ in range(self._burst):
+            val = adc.read_u16()
+            ring[head] = val
+            head += 1
+            if head == n:
+                head = 0
+            if ema:
+                acc += val - (acc >> shift)
+        self._head = head
+
+        if ema:
+            self._ema_acc = acc
+            return acc >> shift
+
+        return _median(ring, self._sorted, n)
+
+    def to_position(self, pot: int) -> float:
+        # """
+        # Convert ADC reading to position. Around [0-1].
+        # """
+        return self.to_fixed(pot) / POSITION_ONE
+
+    @micropython.native
+    def to_fixed(self, pot: int) -> int:
+        # """
+        # Convert ADC reading to fixed point position by table lookup. Around [0-POSITION_ONE].
+        # Readings past the table ends are extrapolated, no allocations unless they are far beyond.
+        # """
+        if self._min <= pot <= self._max:
+            # within the table the product fits 32-bit machine ints of viper code
+            return _to_fixed(self._table, self._base, self._seg_slope, self._seg, self._last_seg, pot, SLOPE_SHIFT)
+        return _to_fixed_py(self._table, self._base, self._seg_slope, self._seg, self._last_seg, pot, SLOPE_SHIFT)
 
     @property
     def position(self) -> float:
         # """
         # Read position. Around [0-1].
         # """
-        pot = self._adc.read_u16()
-        pos = (pot - self._adc_min) / (self._adc_max - self._adc_min)
-
-        return pos
+        return self.to_position(self.raw)
 
 
 class Servo:
@@ -86,38 +432,115 @@ class Servo:
     # """
 
     POSITION_PRECISION = 0.015
+    PRECISION = round(POSITION_PRECISION * POSITION_ONE)  # fixed point
+    CONTROL_PERIOD_MS = 20  # control loop period while moving
+    IDLE_PERIOD_MS = 500  # position hold and stall indication period when motor is off
+    STALL_WINDOW_MS = 300  # stall detection time budget
+    COALESCE_MS = 100  # requested positions are applied not more often while motor runs
+    STALL_SAMPLES = 16  # velocity estimator samples over the window
+
+    # motion profile tracking controller, fixed point
+    KP = 10  # motor output per position error
+    KI = 10  # motor output per position error integral, 1/s
+    MAX_INTEGRAL = 200000  # anti-windup limit, 0.02 position * s in POSITION_ONE * ms
+    MAX_LAG = 500  # reference position lead over actual one, 0.05 position
+    SPEED_EMA_SHIFT = 3  # full power speed estimate smoothing factor is 1 / 2**SPEED_EMA_SHIFT
+    COAST_EMA_SHIFT = 1  # run-down time estimate smoothing factor is 1 / 2**COAST_EMA_SHIFT
+    MAX_COAST_MS = 1000
+
+    # auto-calibration
+    CALIBRATION_OUTPUT = 600  # slow drive to mechanical stops
+    CALIBRATION_POINTS = 11  # position table size, every 10% of the travel
+    CALIBRATION_MARGIN = 300  # travel left out at each stop, 0.03 position
+    CALIBRATION_SAMPLES = 64  # readings recorded over the travel
+    CALIBRATION_NOISE = 256  # reading change meaning the window moves, ADC counts
+    CALIBRATION_TIMEOUT_MS = 120000
 
-    def __init__(self, motor: Motor, pos_sensor: PositionSensor, status_led: Pin):
+    def __init__(self, motor: Motor, pos_sensor: PositionSensor, status_led: Pin, stall_speed: int = 400,
+                 profile: bool = False, speed: float = 0.2, accel: float = 4.):
         # """
         # :param motor: servomotor
         # :param pos_sensor: gearbox axis position sensor
         # :param status_led: status LED
+        # :param stall_speed: minimal axis speed at full motor power, ADC counts per second.
+        #     Scaled by motor power, slower movement is a stall.
+        # :param profile: use trapezoidal motion profile instead of on/off control
+        # :param speed: initial estimate of speed at full motor power, position per second. It's the profile
+        #     cruise speed, refined by measurements while the motor runs steadily. Overestimate converges faster.
+        # :param accel: profile acceleration and deceleration, position per second squared
         # """
         self._motor = motor
         self._pos = pos_sensor
         self._led = status_led
-        self._target_pos: float = None
+        self._target: int = None  # fixed point
+        self._wakeup = asyncio.Event()
+        self._requested: int = None  # latest position request, not applied yet
+        self._applied_ms = 0
+        self.applied: asyncio.Event = None  # set when a request is applied, e.g. to report new state
 
-        # stall detector
-        self._prev_tick_position: float = None
-        self._same_position_read: int = 0
+        # motion profile, fixed point
+        self._profile = profile
+        self._max_speed = round(speed * POSITION_ONE)  # per s, at full power
+        self._accel = round(accel * POSITION_ONE)  # per s**2
+        self._ref: int = None  # reference trajectory position, None when not moving
+        self._ref_speed = 0
+        self._ref_dir = 0
+        self._ref_ms = 0
+        self._integral = 0  # * ms
+        self._coast_ms = 0  # gearbox run-down time: travel after motor stop per speed
+        self._stop_pos: int = None  # where the motor was stopped on arrival, run-down is measured from it
+        self._stop_speed = 0
+        self._stop_dir = 0
+
+        # stall detector: velocity estimator ring buffer
+        self._stall_speed = stall_speed
         self._stalled = False
+        self._cur_pos = 0  # fixed point position of the last reading, kept while the sensor fails
+        self._v_time = array('i', bytes(4 * self.STALL_SAMPLES))
+        self._v_raw = array('i', bytes(4 * self.STALL_SAMPLES))
+        self._v_head = 0
+        self._v_count = 0
+        self._v_dir = 0
+        self._v_start = 0  # ticks_ms of the last start or reversal
+
+        # control loop timing
+        self.late_ticks = 0
+        self.max_lateness_ms = 0
+        self._jitter = diag.histogram('control_jitter', 'ms')  # tick start past its deadline
+        self._cmd_latency = diag.histogram('command_latency')  # new target to motor start
+        self._cmd_us = None
+        self._meter = diag.meter('control') if diag.ENABLED else None
+        self.trace = trace.Recorder() if trace.ENABLED else None  # motion trace
+
+    def _sensor_failed(self):
+        # """
+        # Position can't be read, e.g. external ADC is disconnected: stop and report it as stall
+        # """
+        if not self._stalled:
+            print('Position sensor read failed')
+            self._stalled = True
+            if self.trace:
+                self.trace.stalled = True
+            self.stop(_stalled=True)
 
     def _not_stalled(self):
         # """
         # Clear stale flag
         # """
-        self._prev_tick_position = None
-        self._same_position_read = 0
+        self._v_count = 0
         self._stalled = False
         self._led.off()
 
     @property
     def position(self) -> float:
         # """
-        # Get servomotor position. 0 <= pos <= 1.
+        # Get servomotor position. 0 <= pos <= 1. The last known one if the sensor fails.
         # """
-        return max(0, min(1, self._pos.position))
+        try:
+            self._cur_pos = self._pos.to_fixed(self._pos.raw)
+        except OSError:
+            self._sensor_failed()
+        return max(0, min(1, self._cur_pos / POSITION_ONE))
 
     @position.setter
     def position(self, new_pos: float):
@@ -127,9 +550,57 @@ class Servo:
         # :param new_pos: new position. 0 <= pos <= 1.
         # """
         assert 0 <= new_pos <= 1
-        self._target_pos = new_pos
+        if diag.TIMING and not self.running:
+            self._cmd_us = time.ticks_us()
+        self._retarget(round(new_pos * POSITION_ONE))
+
+    def _retarget(self, target: int):
+        # """
+        # Move to new target
 
+        # :param target: fixed point position
+        # """
+        self._target = target
+        self._ref = None  # replan from actual position
         self._not_stalled()
+        self._wakeup.set()
+
+    def request(self, new_pos: float):
+        # """
+        # Command intake: requests are coalesced, the latest one wins. It is applied on the next control tick,
+        # while motor runs not more often than once per COALESCE_MS, so bursts of commands (slider drags)
+        # neither jerk the motor nor flood state reports.
+
+        # :param new_pos: new position. 0 <= pos <= 1.
+        # """
+        assert 0 <= new_pos <= 1
+        if diag.TIMING and self._requested is None and not self.running:
+            self._cmd_us = time.ticks_us()
+        self._requested = round(new_pos * POSITION_ONE)
+        self._wakeup.set()
+
+    def _apply_request(self):
+        # """
+        # Apply pending request unless motor was retargeted too recently
+        # """
+        now = time.ticks_ms()
+        if self._motor.running and time.ticks_diff(now, self._applied_ms) < self.COALESCE_MS:
+            return
+
+        target = self._requested
+        self._requested = None
+        self._applied_ms = now
+        if target != self._target or self._stalled:
+            self._retarget(target)
+        if self.applied:
+            self.applied.set()
+
+    @property
+    def target(self) -> float:
+        # """
+        # Position being moved to or held. None when stopped.
+        # """
+        return None if self._target is None else self._target / POSITION_ONE
 
     def stop(self, _stalled: bool = False):
         # """
@@ -137,7 +608,10 @@ class Servo:
 
         # :param _stalled: can't move
         # """
-        self._target_pos = None
+        self._target = None
+        self._requested = None
+        self._ref = None
+        self._ref_speed = 0
         self._motor.stop()
 
         if not _stalled:
@@ -150,6 +624,20 @@ class Servo:
         # """
         return self._motor.running
 
+    @property
+    def direction(self) -> int:
+        # """
+        # Position change direction: 1 opening, -1 closing, 0 stopped
+        # """
+        return self._motor.direction if self._motor.running else 0
+
+    @property
+    def pos_sensor(self) -> PositionSensor:
+        # """
+        # Gearbox axis position sensor
+        # """
+        return self._pos
+
     @property
     def stalled(self) -> bool:
         # """
@@ -157,37 +645,393 @@ class Servo:
         # """
         return self._stalled
 
+    @micropython.native
     def tick(self):
         # """
-        # Process state changes
+        # Process state changes. Integer arithmetic only, steady state ticks are written not to allocate.
         # """
-        # print(f'{self._stalled=}, {self._target_pos=}, {self.running=}')
+        # print(f'{self._stalled=}, {self._target=}, {self.running=}')
 
         if self._stalled:
             self._led.value(not self._led.value())
 
-        if self._target_pos is None:
+        if self._target is None:
             return
 
-        cur_pos = self._pos.position
+        try:
+            raw = self._pos.raw  # single filtered reading per tick
+        except OSError:
+            self._sensor_failed()
+            return
+        cur_pos = self._pos.to_fixed(raw)
+        self._cur_pos = cur_pos
 
-        if self.running and cur_pos == self._prev_tick_position:
-            self._same_position_read += 1
-            if self._same_position_read > 1:
+        direction = self._motor.direction
+        now = time.ticks_ms()
+        if direction != self._v_dir:
+            # started, stopped or reversed: restart velocity estimation
+            self._v_dir = direction
+            self._v_count = 0
+            self._v_start = now
+        if self.trace:
+            self.trace.add(now, raw, self._target, direction, self._motor.duty_u16)
+        if direction:
+            speed = self._speed(now, raw)
+            # expected speed is proportional to power above static friction
+            motor = self._motor
+            min_speed = (self._stall_speed * (motor.duty_u16 - motor.min_power_u16)
+                         // (UINT16_MAX - motor.min_power_u16))
+            if speed is not None and speed * direction < min_speed:
                 self._stalled = True
+                if self.trace:
+                    self.trace.stalled = True
                 self.stop(_stalled=True)
                 return
-        else:
-            self._prev_tick_position = cur_pos
-            self._same_position_read = 0
 
-        pos_error = self._pos.position - self._target_pos
+            if self._profile and speed is not None and time.ticks_diff(now, self._v_start) >= self.STALL_WINDOW_MS:
+                self._learn_speed(speed * direction)
+
+        if self._profile:
+            self._track_profile(now, cur_pos)
+            return
+
+        pos_error = cur_pos - self._target
 
         # avoid small movements
-        tol = self.POSITION_PRECISION / 3 if self.running else self.POSITION_PRECISION
+        tol = self.PRECISION // 3 if self.running else self.PRECISION
         if abs(pos_error) < tol:
             self._motor.stop()
         elif pos_error > 0:
             self._motor.cw()
         else:
             self._motor.ccw()
+
+    def _account_command(self):
+        # """
+        # Command latency, measured on the first tick after new target
+        # """
+        if self._motor.running:
+            self._cmd_latency.add(time.ticks_diff(time.ticks_us(), self._cmd_us))
+        self._cmd_us = None
+
+    def _step(self):
+        # """
+        # Control loop iteration: pending request, metered tick and command latency accounting
+        # """
+        if self._requested is not None:
+            self._apply_request()
+        if diag.ENABLED:
+            # inline metering, decorator call with packed arguments would allocate itself
+            before = gc.mem_alloc()
+            self.tick()
+            self._meter.add(gc.mem_alloc() - before)
+        else:
+            self.tick()
+        if self._cmd_us is not None:
+            self._account_command()
+
+    async def run(self, period_ms: int = CONTROL_PERIOD_MS):
+        # """
+        # Control loop task of this servo alone
+
+        # :param period_ms: control period while moving, ms
+        # """
+        await Servo.run_group((self,), period_ms)
+
+    @staticmethod
+    async def run_group(servos: tuple, period_ms: int = CONTROL_PERIOD_MS):
+        # """
+        # Control loop task shared by servos. Ticks on fixed ticks_ms schedule while any motor is running,
+        # slowly while holding position or stalled, and sleeps until new target otherwise.
+
+        # :param servos: servos to control, none if no window is configured
+        # :param period_ms: control period while moving, ms
+        # """
+        if not servos:
+            return
+
+        wakeup = asyncio.Event()  # new target of any servo wakes the loop up immediately
+        for servo in servos:
+            servo._wakeup = wakeup
+        jitter = servos[0]._jitter
+
+        deadline = time.ticks_ms()
+        while True:
+            running = hold = False
+            for servo in servos:
+                servo._step()
+                if servo.running or servo._ref is not None:  # motion profile may have zero output for a tick
+                    running = True
+                elif servo._target is not None or servo._stalled:
+                    hold = True
+
+            if not running:
+                wakeup.clear()
+                if hold:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), Servo.IDLE_PERIOD_MS / 1000)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await wakeup.wait()
+                deadline = time.ticks_ms()
+                continue
+
+            # schedule from previous deadline, not from now, so the period doesn't drift
+            deadline = time.ticks_add(deadline, period_ms)
+            delay = time.ticks_diff(deadline, time.ticks_ms())
+            if delay < 0:
+                # overrun, skip missed ticks
+                for servo in servos:
+                    servo.late_ticks += 1
+                    if -delay > servo.max_lateness_ms:
+                        servo.max_lateness_ms = -delay
+                deadline = time.ticks_ms()
+                delay = 0
+
+            await asyncio.sleep_ms(delay)
+            if diag.TIMING:
+                jitter.add(time.ticks_diff(time.ticks_ms(), deadline))
+
+    @micropython.native
+    def _speed(self, now: int, raw: int):
+        # """
+        # Velocity estimator. Least squares slope of readings sampled evenly over the stall window.
+
+        # :param now: ticks_ms timestamp
+        # :param raw: ADC reading
+        # :return: ADC counts per second, None if no new estimate
+        # """
+        times = self._v_time
+        raws = self._v_raw
+        n_max = self.STALL_SAMPLES
+        head = self._v_head
+        n = self._v_count
+
+        if n:
+            last = head - 1 if head else n_max - 1
+            if time.ticks_diff(now, times[last]) < self.STALL_WINDOW_MS // (n_max - 1):
+                return None  # too early for next sample
+
+        times[head] = now
+        raws[head] = raw
+        head += 1
+        if head == n_max:
+            head = 0
+        self._v_head = head
+        if n < n_max:
+            n += 1
+            self._v_count = n
+
+        first = head - n
+        if first < 0:
+            first += n_max
+        span = time.ticks_diff(now, times[first])
+        if span < self.STALL_WINDOW_MS:
+            return None
+
+        # samples spread over the window, so the slope denominator is positive
+        if span > SLOPE_NATIVE_MAX_SPAN_MS:
+            return _slope_py(times, raws, first, n, n_max)  # late ticks, rare
+        return _slope(times, raws, first, n, n_max)
+
+    @micropython.native
+    def _learn_speed(self, speed: int):
+        # """
+        # Refine full power speed estimate with a measurement at steady drive. Speed is taken
+        # as proportional to motor output, like profile speed feedforward does.
+
+        # :param speed: axis speed along motor direction, ADC counts per second
+        # """
+        motor = self._motor
+        span = motor.power_u16 - motor.min_power_u16
+        level = (motor.duty_u16 - motor.min_power_u16) * OUTPUT_MAX // span if span else OUTPUT_MAX
+        if speed <= 0 or level < OUTPUT_MAX // 2 or self._ref_speed != self._max_speed:
+            return  # reference accelerates or brakes, or output is too low for the linear model
+
+        pos = self._pos
+        full = speed * POSITION_ONE // (pos._max - pos._min) * OUTPUT_MAX // level
+        self._max_speed += (full - self._max_speed) >> self.SPEED_EMA_SHIFT
+
+    @micropython.native
+    def _learn_coast(self, cur_pos: int):
+        # """
+        # Refine run-down time estimate with the travel since the motor was stopped on arrival
+
+        # :param cur_pos: actual position, fixed point
+        # """
+        if self._stop_speed:
+            coast_ms = (cur_pos - self._stop_pos) * self._stop_dir * 1000 // self._stop_speed
+            coast_ms = max(0, min(self.MAX_COAST_MS, coast_ms))
+            self._coast_ms += (coast_ms - self._coast_ms) >> self.COAST_EMA_SHIFT
+        self._stop_pos = None
+
+    @micropython.native
+    def _track_profile(self, now: int, cur_pos: int):
+        # """
+        # Trapezoidal motion profile: reference position accelerates to cruise speed and decelerates
+        # to stop at target. Motor output is speed feedforward plus PI correction of reference tracking error.
+
+        # :param now: ticks_ms timestamp
+        # :param cur_pos: actual position, fixed point
+        # """
+        target = self._target
+
+        if self._ref is None:
+            if self._stop_pos is not None:
+                self._learn_coast(cur_pos)
+
+            # plan new movement
+            if abs(cur_pos - target) < self.PRECISION:
+                self._motor.stop()
+                self._ref_speed = 0
+                return
+
+            direction = 1 if target > cur_pos else -1
+            if direction != self._ref_dir or not self._motor.running:
+                self._ref_speed = 0  # start from rest, keep speed on retarget in the same direction
+            self._ref_dir = direction
+            self._ref = cur_pos
+            self._ref_ms = time.ticks_add(now, -self.CONTROL_PERIOD_MS)  # the first tick ramps output up
+            self._integral = 0
+
+        dt = time.ticks_diff(now, self._ref_ms)  # ms
+        self._ref_ms = now
+
+        # reference trajectory step. Braking is planned from actual position: the window lags behind
+        # the reference, which would otherwise stop early and leave the rest to weak error correction.
+        remaining = abs(target - self._ref)
+        max_speed = self._max_speed
+        ref_speed = min(self._ref_speed + self._accel * dt // 1000, max_speed)
+        brake = 2 * self._accel * max(0, (target - cur_pos) * self._ref_dir)
+        if brake < ref_speed * ref_speed:
+            ref_speed = _isqrt(brake, ref_speed)
+        step = ref_speed * dt // 1000
+        if step >= remaining:
+            self._ref = target
+        else:
+            self._ref += self._ref_dir * step
+        self._ref_speed = ref_speed
+
+        # don't let reference run away from slow or loaded motor
+        lead = self._ref - cur_pos
+        if lead > self.MAX_LAG:
+            self._ref = cur_pos + self.MAX_LAG
+        elif lead < -self.MAX_LAG:
+            self._ref = cur_pos - self.MAX_LAG
+
+        error = self._ref - cur_pos
+        to_go = (target - cur_pos) * self._ref_dir
+        if to_go < self.PRECISION // 3 + ref_speed * self._coast_ms // 1000:
+            # arrived, passed the target or close enough for gearbox run-down to bring the window there
+            self._motor.stop()
+            self._ref = None
+            self._ref_speed = 0
+            if -to_go >= self.PRECISION:
+                # overshoot: correction profile back from rest
+                self._ref_dir = 0
+                self._track_profile(now, cur_pos)
+            else:
+                self._stop_pos = cur_pos
+                self._stop_speed = ref_speed
+                self._stop_dir = self._ref_dir
+            return
+
+        if (error > 0) != (self._integral > 0):
+            self._integral = 0  # window passed the reference, wound up integral would push it further
+        self._integral = max(-self.MAX_INTEGRAL, min(self.MAX_INTEGRAL, self._integral + error * dt))
+        correction = (self.KP * error + self.KI * self._integral // 1000) * OUTPUT_MAX // POSITION_ONE
+        output = ref_speed * OUTPUT_MAX // max_speed + self._ref_dir * correction
+        # negative output brakes by reversing when the window runs ahead of the reference
+        self._motor.drive(self._ref_dir * output)
+
+    async def calibrate(self, output: int = CALIBRATION_OUTPUT, points: int = CALIBRATION_POINTS) -> list:
+        # """
+        # Find mechanical stops by driving slowly until stall, closed one first, and sample readings over
+        # the opening travel. Position is taken as proportional to travel time at constant power.
+        # New position table is applied to the sensor. Any command or stop interrupts calibration.
+
+        # :param output: motor output, [1-OUTPUT_MAX]
+        # :param points: position table size
+        # :return: position table, see PositionSensor.set_table()
+        # :raise ValueError: calibration failed, mapping is not changed
+        # :raise CalibrationInterrupted: command or stop was given meanwhile, mapping is not changed
+        # """
+        self.stop()
+        await self._seek_stop(-output, None)
+        await asyncio.sleep_ms(self.STALL_WINDOW_MS)  # run-down
+
+        samples = array('H', bytes(2 * self.CALIBRATION_SAMPLES))
+        n = await self._seek_stop(output, samples)
+
+        # travel: from the last reading at closed stop to the first one at opened stop
+        tol = self.CALIBRATION_NOISE
+        start = 0
+        while start < n - 1 and samples[start + 1] <= samples[0] + tol:
+            start += 1
+        end = n - 1
+        while end > start and samples[end - 1] >= samples[n - 1] - tol:
+            end -= 1
+        if end - start < 2:
+            raise ValueError("Window doesn't move")
+
+        span = POSITION_ONE - 2 * self.CALIBRATION_MARGIN
+        table = []
+        for k in range(points):
+            x = (self.CALIBRATION_MARGIN + k * span // (points - 1)) * (end - start)
+            i = start + x // POSITION_ONE
+            table.append(samples[i] + (samples[i + 1] - samples[i]) * (x % POSITION_ONE) // POSITION_ONE)
+
+        self._pos.set_table(table)
+        return table
+
+    async def _seek_stop(self, output: int, samples) -> int:
+        # """
+        # Drive until stall
+
+        # :param output: motor output, positive opens
+        # :param samples: buffer for readings evenly spaced in time, None to not record.
+        #     Full buffer is decimated, so it covers the whole movement.
+        # :return: readings recorded
+        # """
+        motor = self._motor
+        motor.drive(output)
+        direction = motor.direction
+        min_speed = (self._stall_speed * (motor.duty_u16 - motor.min_power_u16)
+                     // (UINT16_MAX - motor.min_power_u16))
+        self._v_count = 0
+
+        start = next_sample = time.ticks_ms()
+        interval = self.CONTROL_PERIOD_MS
+        n = 0
+        try:
+            while True:
+                await asyncio.sleep_ms(self.CONTROL_PERIOD_MS)
+                if self._target is not None or not motor.running:
+                    raise CalibrationInterrupted('Calibration interrupted')
+
+                now = time.ticks_ms()
+                if time.ticks_diff(now, start) > self.CALIBRATION_TIMEOUT_MS:
+                    raise ValueError('Mechanical stop not found')
+
+                raw = self._pos.raw
+                if samples is not None and time.ticks_diff(now, next_sample) >= 0:
+                    if n == len(samples):
+                        # keep every other reading, the next one falls on doubled interval grid
+                        n >>= 1
+                        for i in range(n):
+                            samples[i] = samples[2 * i]
+                        interval *= 2
+                    samples[n] = raw
+                    n += 1
+                    next_sample = time.ticks_add(next_sample, interval)
+                    if time.ticks_diff(now, next_sample) >= 0:
+                        next_sample = time.ticks_add(now, interval)  # late ticks
+
+                speed = self._speed(now, raw)
+                if speed is not None and speed * direction < min_speed:
+                    return n
+        finally:
+            if self._target is None:  # not taken over by a command
+                motor.stop()
+            motor.set_power(motor.power, motor.min_power)  # full power for on/off control
@@ -1,5 +1,7 @@
 import json
+import os
 
+from wa import startup
 from wa.utils import wifi_mac
 
 
@@ -24,27 +26,50 @@ class Parameter:
 
     def __set__(self, obj, value):
         try:
-            val = self._type(value)
+            val = self._copy(self._type(value))
         except ValueError:
             raise ValueError(
                 f'Parameter "{self._public_name}" has {self._type.__name__} type, '
                 f'but set with "{value}" value of type {type(value).__name__}'
             )
         self._validate(val)
+        if val == self.__get__(obj):
+            return
+
         obj._stor[self._public_name] = val
+        obj._cache[self._public_name] = val
+        obj._dirty.add(self._public_name)
 
     def __get__(self, obj, objtype=None):
-        val = obj._stor.get(self._public_name)
-        if val is None:
-            return self._default
+        if obj is None:
+            return self
 
+        name = self._public_name
         try:
-            val = self._type(val)
-        except ValueError:
-            val = self._default
-            del obj._stor[self._public_name]
-
-        return val
+            val = obj._cache[name]
+        except KeyError:
+            val = obj._stor.get(name)
+            if val is None:
+                val = self._default
+            else:
+                try:
+                    val = self._type(val)
+                except ValueError:
+                    val = self._default
+                    del obj._stor[name]
+
+            obj._cache[name] = val
+
+        return self._copy(val)
+
+    @staticmethod
+    def _copy(value):
+        # """
+        # Deep copy of list or dict value, so changing it in place alters neither the stored value nor the default
+        # """
+        if isinstance(value, (list, dict)):
+            return json.loads(json.dumps(value))
+        return value
 
     def _validate(self, value):
         # """
@@ -86,6 +111,12 @@ class PasswordParameter(Parameter):
 
 
 class SettingsStorage:
+    # """
+    # Settings kept in JSON file. Changes are appended to a journal file, which is
+    # folded into the main file by rewrite through temporary file once it grows, to spread flash writes.
+    # """
+
+    JOURNAL_MAX_RECORDS = 8  # compaction threshold
 
     device_name = Parameter('device_name', str, f'wa_{wifi_mac()[-4:]}')
 
@@ -96,28 +127,107 @@ class SettingsStorage:
     mqtt_port = Parameter('mqtt_port', int, 1883)
     mqtt_user = Parameter('mqtt_user', str)
     mqtt_password = PasswordParameter('mqtt_password')
+    mqtt_groups = Parameter('mqtt_groups', list, [])  # group command topics to follow, e.g. ["all", "floor3"]
+    group_jitter_ms = Parameter('group_jitter_ms', int, 0)  # group commands random delay limit
 
     motor_power = PercentParameter('motor_power', 100)
+    motor_min_power = PercentParameter('motor_min_power', 0)
+    motion_profile = Parameter('motion_profile', int, 0)  # 1 for gearbox running down slowly, see wa.servo.Servo
     window_opened_pos = PercentParameter('window_opened_pos', 81)
     window_closed_pos = PercentParameter('window_closed_pos', 24)
+    control_period_ms = Parameter('control_period_ms', int, 20)
+    live_period_ms = Parameter('live_period_ms', int, 250)
+    # web server budget, see wa.web.WebServer
+    http_max_connections = Parameter('http_max_connections', int, 4)
+    http_max_websockets = Parameter('http_max_websockets', int, 2)
+    http_max_header_b = Parameter('http_max_header_b', int, 1024)
+    http_max_body_b = Parameter('http_max_body_b', int, 1024)
+    http_timeout_ms = Parameter('http_timeout_ms', int, 5000)
+    trace_on_stall = Parameter('trace_on_stall', int, 1)  # save motion trace to flash when window stalls
+    # actuators: list of {"name", "channel": "A"|"B", "sensor": "adc"|"ads1115:<input>", movement overrides,
+    # "position_table" from calibration}, all keys optional, see main.window_settings()
+    windows = Parameter('windows', list, [{}])
 
     def __init__(self, path: str):
         # """
         # :param path: JSON configuration file path
         # """
         self._path = path
+        self._tmp_path = path + '.tmp'
+        self._journal_path = path + '.journal'
+        self._cache = {}  # decoded values
+        self._dirty = set()  # changed since last save
+        self._stor = self._load(self._path)
+        if self._stor is None:
+            # rename isn't atomic on FAT: compaction may be cut off after the old file is gone.
+            # Complete temporary file holds all settings then, the journal is replayed over it harmlessly.
+            self._stor = self._load(self._tmp_path)
+            if self._stor is None:
+                self._stor = {}
+            else:
+                os.rename(self._tmp_path, self._path)
+
+        # replay changes made after last compaction. Torn last record of interrupted write is dropped.
+        self._journal_records = 0
+        try:
+            with open(self._journal_path, encoding='utf8') as f:
+                for line in f:
+                    try:
+                        self._stor.update(json.loads(line))
+                    except ValueError:
+                        self._journal_records = self.JOURNAL_MAX_RECORDS  # don't append after garbage
+                        break
+                    self._journal_records += 1
+        except OSError:
+            pass
+
+    @staticmethod
+    def _load(path: str):
+        # """
+        # Read settings file
+
+        # :return: settings, None if the file is missing or torn
+        # """
         try:
-            with open(self._path, encoding='utf8') as f:
-                self._stor = json.load(f)
-        except FileNotFoundError:
-            self._stor = {}
+            with open(path, encoding='utf8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self) -> bool:
+        # """
+        # Write changed settings to disk
+
+        # :return: something was written
+        # """
+        if not self._dirty:
+            return False
+
+        if self._journal_records >= self.JOURNAL_MAX_RECORDS:
+            self._compact()
+        else:
+            record = {name: self._stor[name] for name in self._dirty}
+            with open(self._journal_path, 'a', encoding='utf8') as f:
+                f.write(json.dumps(record) + '\n')
+            self._journal_records += 1
+
+        self._dirty.clear()
+        return True
 
-    def save(self):
+    def _compact(self):
         # """
-        # Write settings to disk
+        # Replace settings file with the full current settings and drop the journal
         # """
-        with open(self._path, 'w', encoding='utf8') as f:
+        with open(self._tmp_path, 'w', encoding='utf8') as f:
             json.dump(self._stor, f)
+        os.rename(self._tmp_path, self._path)  # not atomic on FAT, see __init__()
+
+        try:
+            os.remove(self._journal_path)
+        except OSError:
+            pass
+        self._journal_records = 0
 
 
 config = SettingsStorage('settings.json')  # instance for global use
+startup.mark('config')
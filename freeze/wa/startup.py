@@ -0,0 +1,21 @@
+import time
+
+
+_phases = {}  # boot phase -> ticks_ms when done
+
+
+def mark(phase: str):
+    # """
+    # Record boot phase completion time
+
+    # :param phase: phase name
+    # """
+    _phases[phase] = time.ticks_ms()
+    print(f'Boot phase "{phase}" done at {_phases[phase]} ms')
+
+
+def phases() -> dict:
+    # """
+    # Boot phases completion times, ms since power-up
+    # """
+    return _phases
@@ -0,0 +1,163 @@
+import asyncio
+import struct
+import time
+from array import array
+
+
+ENABLED = True  # servo motion recording, costs a call and five array stores per control tick
+SAMPLES = 256  # ring buffer length, 9 bytes per sample, ~5 s of motion at 20 ms control period
+SNAPSHOT_PATH = 'trace_{}.bin'  # stall snapshot file of a window
+SNAPSHOT_CHECK_S = 1
+GAP = 65535  # time delta of the first sample after idle period, ms
+
+# binary format, little-endian: magic, samples count, then fields of all samples in chronological order,
+# field by field: time delta u16, raw ADC u16, target u16, PWM duty u16, motor direction i8
+_MAGIC = b'WAT1'
+_HEADER = '<4sH'
+_CSV_CHUNK = 16  # lines per chunk
+
+
+class Recorder:
+    # """
+    # Servo motion trace in preallocated ring buffer. Samples are taken while motor runs and on the tick
+    # it stops, so idle position hold doesn't overwrite recent moves.
+    # """
+
+    def __init__(self, samples: int = SAMPLES):
+        # """
+        # :param samples: ring buffer length
+        # """
+        self._dt = array('H', bytes(2 * samples))
+        self._raw = array('H', bytes(2 * samples))
+        self._target = array('H', bytes(2 * samples))
+        self._duty = array('H', bytes(2 * samples))
+        self._dir = array('b', bytes(samples))
+        self._size = samples
+        self._head = 0
+        self._count = 0
+        self._last = time.ticks_ms()
+        self._last_dir = 0
+        self.stalled = False  # stall happened since last snapshot
+
+    def add(self, now: int, raw: int, target: int, direction: int, duty: int):
+        # """
+        # Record control tick state. No allocations.
+
+        # :param now: ticks_ms timestamp
+        # :param raw: filtered ADC reading
+        # :param target: target position, fixed point
+        # :param direction: motor direction: -1 CW, 1 CCW, 0 stopped
+        # :param duty: motor PWM duty [0-65535]
+        # """
+        if not direction and not self._last_dir:
+            return  # idle
+        self._last_dir = direction
+
+        i = self._head
+        dt = time.ticks_diff(now, self._last)
+        self._last = now
+        self._dt[i] = dt if dt < GAP else GAP
+        self._raw[i] = raw
+        self._target[i] = target
+        self._duty[i] = duty
+        self._dir[i] = direction
+
+        i += 1
+        if i == self._size:
+            i = 0
+        self._head = i
+        if self._count < self._size:
+            self._count += 1
+
+    def _order(self):
+        # """
+        # Chronological index ranges of recorded samples
+        # """
+        if self._count < self._size:
+            return ((0, self._count),)
+        return (self._head, self._size), (0, self._head)
+
+    def binary(self):
+        # """
+        # Trace in binary format
+
+        # :return: generator of bytes chunks
+        # """
+        yield struct.pack(_HEADER, _MAGIC, self._count)
+        order = self._order()
+        for field in (self._dt, self._raw, self._target, self._duty, self._dir):
+            view = memoryview(field)
+            for start, end in order:
+                yield bytes(view[start:end])
+
+    def csv(self, to_fixed=None):
+        # """
+        # Trace as CSV: time since the first sample (gaps are counted as GAP), ADC reading, position,
+        # target, motor direction and PWM duty. Positions are fixed point.
+
+        # :param to_fixed: ADC reading to position conversion, position column is empty if None
+        # :return: generator of text chunks
+        # """
+        yield 't_ms,raw,position,target,direction,duty\n'
+        t = None
+        lines = []
+        for start, end in self._order():
+            for i in range(start, end):
+                t = 0 if t is None else t + self._dt[i]
+                raw = self._raw[i]
+                pos = '' if to_fixed is None else to_fixed(raw)
+                lines.append(f'{t},{raw},{pos},{self._target[i]},{self._dir[i]},{self._duty[i]}\n')
+                if len(lines) == _CSV_CHUNK:
+                    yield ''.join(lines)
+                    lines.clear()
+        if lines:
+            yield ''.join(lines)
+
+    def save(self, path: str):
+        # """
+        # Write trace to file in binary format
+        # """
+        with open(path, 'wb') as f:
+            for chunk in self.binary():
+                f.write(chunk)
+
+    @staticmethod
+    def load(path: str) -> 'Recorder':
+        # """
+        # Read trace saved in binary format
+
+        # :return: None if there is no valid trace, e.g. file is truncated by power loss while saving
+        # """
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(struct.calcsize(_HEADER))
+                if len(header) != struct.calcsize(_HEADER):
+                    return None
+                magic, count = struct.unpack(_HEADER, header)
+                if magic != _MAGIC:
+                    return None
+                rec = Recorder(max(1, count))
+                for field, size in ((rec._dt, 2), (rec._raw, 2), (rec._target, 2), (rec._duty, 2), (rec._dir, 1)):
+                    if f.readinto(memoryview(field)[:count]) != count * size:
+                        return None
+                if f.read(1):
+                    return None  # count doesn't match the data
+        except (OSError, ValueError):
+            return None
+
+        rec._count = count
+        return rec
+
+
+async def run(recorders: list):
+    # """
+    # Stall snapshots task: traces of stalled servos are saved to flash outside of control loop
+
+    # :param recorders: (window name, Recorder) pairs
+    # """
+    while True:
+        for name, rec in recorders:
+            if rec.stalled:
+                rec.stalled = False
+                rec.save(SNAPSHOT_PATH.format(name))
+        await asyncio.sleep(SNAPSHOT_CHECK_S)
@@ -1,19 +1,300 @@
-from microdot import Microdot, Response
+import asyncio
+import gc
+import json
+import time
+
+from microdot import Microdot, Request, Response
+
+from wa import diag
 
 
 HTML_ROOT = 'html/'
+ASSETS_INDEX = HTML_ROOT + 'assets.json'  # written by build_assets.py
+ASSETS_MAX_AGE_S = 7 * 24 * 3600
+
+
+class _RequestStream:
+    # """
+    # Connection reader with request header size budget. Keeps a line read ahead by keep-alive wait.
+    # """
+
+    def __init__(self, reader):
+        self._reader = reader
+        self.header_budget = 0
+        self._line = None
+
+    async def readline(self) -> bytes:
+        line = self._line
+        if line is None:
+            line = await self._reader.readline()
+        self._line = None
+        self.header_budget -= len(line)
+        if self.header_budget < 0:
+            raise ValueError('request header too large')
+        return line
+
+    def unread_line(self, line: bytes):
+        self._line = line
+
+    async def readexactly(self, n: int) -> bytes:
+        return await self._reader.readexactly(n)
+
+    async def read(self, n: int = -1) -> bytes:
+        return await self._reader.read(n)
+
+
+class WebServer(Microdot):
+    # """
+    # Microdot with connection budget, so HTTP can't take sockets and heap from control and MQTT.
+    # Concurrent connections, request size and time are limited. Responses of known length keep
+    # the connection alive for the next request, e.g. page assets. Idle kept-alive connection
+    # is closed when its slot is needed. WebSocket sessions have their own budget, the oldest one
+    # is closed for a new one.
+    # """
+
+    MAX_CONNECTIONS = 4
+    MAX_WEBSOCKETS = 2
+    MAX_HEADER_B = 1024  # request line and headers
+    MAX_BODY_B = 1024
+    TIMEOUT_MS = 5000  # request receiving and response sending
+    KEEPALIVE_MS = 3000  # idle time before closing kept-alive connection
+    KEEPALIVE_REQUESTS = 16  # per connection
+    _REJECT = b'HTTP/1.0 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+    def __init__(self):
+        super().__init__()
+        self.max_connections = self.MAX_CONNECTIONS
+        self.max_websockets = self.MAX_WEBSOCKETS
+        self.max_header_b = self.MAX_HEADER_B
+        self.timeout_ms = self.TIMEOUT_MS
+        self.set_max_body(self.MAX_BODY_B)
+        self.connections = 0
+        self.rejected = 0
+        self._idle = []  # tasks of idle kept-alive connections, oldest first
+        self._websockets = []  # tasks of WebSocket sessions, oldest first
+
+    @staticmethod
+    def set_max_body(size: int):
+        # """
+        # Larger requests are answered with 413
+        # """
+        Request.max_content_length = Request.max_body_length = size
+
+    def websocket_session(self, f):
+        # """
+        # Decorator of WebSocket handler, applied under with_websocket. Upgraded connection gives its
+        # HTTP slot back and takes a WebSocket one, so long sessions don't starve page requests.
+        # """
+        async def session(request, ws, *args, **kwargs):
+            task = asyncio.current_task()
+            self.connections -= 1
+            self._websockets.append(task)
+            if len(self._websockets) > self.max_websockets:
+                self._websockets.pop(0).cancel()  # e.g. left open by a forgotten page
+            try:
+                await f(request, ws, *args, **kwargs)
+            except asyncio.CancelledError:
+                pass  # slot is given to a new session
+            finally:
+                if task in self._websockets:
+                    self._websockets.remove(task)
+                self.connections += 1  # released by handle_request()
+
+        return session
+
+    async def handle_request(self, reader, writer):
+        if self.connections >= self.max_connections:
+            if not self._idle:
+                self.rejected += 1
+                try:
+                    await writer.awrite(self._REJECT)
+                    await writer.aclose()
+                except OSError:
+                    pass
+                return
+
+            self._idle.pop(0).cancel()  # oldest idle connection gives its slot up
+
+        self.connections += 1
+        try:
+            await self._serve(_RequestStream(reader), writer)
+        except Exception:  # client gone or broken response, the connection is dropped
+            pass
+        finally:
+            self.connections -= 1
+            try:
+                await writer.aclose()
+            except OSError:
+                pass
+
+    async def _serve(self, stream: _RequestStream, writer):
+        # """
+        # Serve requests of one connection
+        # """
+        timeout = self.timeout_ms / 1000
+        for n in range(self.KEEPALIVE_REQUESTS):
+            if n:
+                # wait for next request as idle connection, which can be closed for a new one
+                task = asyncio.current_task()
+                self._idle.append(task)
+                try:
+                    line = await asyncio.wait_for(stream._reader.readline(), self.KEEPALIVE_MS / 1000)
+                except asyncio.CancelledError:
+                    return  # slot is given to a new connection
+                finally:
+                    if task in self._idle:
+                        self._idle.remove(task)
+                if not line:
+                    return
+                stream.unread_line(line)
+
+            stream.header_budget = self.max_header_b
+            try:
+                req = await asyncio.wait_for(
+                    Request.create(self, stream, writer, writer.get_extra_info('peername')), timeout
+                )
+                if req is None:
+                    return
+
+                res = await self.dispatch_request(req)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                await writer.awrite(b'HTTP/1.0 408 Request Timeout\r\nConnection: close\r\n\r\n')
+                return
+            except Exception:  # malformed request, e.g. request line without version
+                await writer.awrite(b'HTTP/1.0 431 Request Header Fields Too Large\r\nConnection: close\r\n\r\n'
+                                    if stream.header_budget < 0 else
+                                    b'HTTP/1.0 400 Bad Request\r\nConnection: close\r\n\r\n')
+                return
 
-web_server = Microdot()
+            if res == Response.already_handled:  # WebSocket session is over
+                return
+
+            res.complete()
+            conn = req.headers.get('Connection', '').lower()
+            keep = (
+                (conn == 'keep-alive' if req.http_version == '1.0' else conn != 'close')
+                and 'Content-Length' in res.headers  # body end is known to client
+                and req.content_length <= Request.max_body_length  # body was read
+                and n < self.KEEPALIVE_REQUESTS - 1
+            )
+            res.headers['Connection'] = 'keep-alive' if keep else 'close'
+            await asyncio.wait_for(res.write(writer), timeout)
+            if self.debug:
+                print(f'{req.method} {req.path} {res.status_code}')
+            if not keep:
+                return
+
+
+web_server = WebServer()
 Response.default_content_type = 'text/html'
+Response.send_file_buffer_size = 512  # flash to socket streaming chunk
+
+
+def _load_assets_index() -> dict:
+    # """
+    # Prebuilt assets ETags, sizes and content types. Empty if assets are uploaded as is.
+    # """
+    try:
+        with open(ASSETS_INDEX, encoding='utf8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+_assets = _load_assets_index()
+
+
+def _metered_static(handler):
+    # """
+    # Decorator accounting static file route allocations. File is streamed after the handler returns,
+    # so it's read by metered send_file_buffer_size chunks, one call with the response creation.
+    # """
+    if not diag.ENABLED:
+        return handler
+
+    def route(request):
+        before = gc.mem_alloc()
+        res = handler(request)
+        alloc = gc.mem_alloc() - before
+        if hasattr(res.body, 'read'):
+            res.body = diag.metered_iter('static', _file_chunks(res.body), alloc)
+        else:
+            diag.meter('static').add(alloc)
+        return res
+
+    return route
+
+
+def _file_chunks(f):
+    try:
+        while True:
+            buf = f.read(Response.send_file_buffer_size)
+            if not buf:
+                return
+            yield buf
+    finally:
+        f.close()
 
 
 def add_file_route(file: str, url=None):
     if url is None:
         url = '/' + file
 
-    web_server.route(url)(
-        lambda _: Response.send_file(HTML_ROOT + file)
-    )
+    asset = _assets.get(file)
+    if asset is None:
+        web_server.route(url)(
+            _metered_static(lambda _: Response.send_file(HTML_ROOT + file))
+        )
+        return
+
+    # gzipped asset, revalidated by ETag
+    etag = '"' + asset['etag'] + '"'
+    cache_control = f'max-age={ASSETS_MAX_AGE_S}'
+
+    @_metered_static
+    def send_asset(request):
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': cache_control})
+
+        res = Response.send_file(
+            HTML_ROOT + file,
+            content_type=asset['type'],
+            max_age=ASSETS_MAX_AGE_S,
+            compressed=True,
+            file_extension='.gz'
+        )
+        res.headers['ETag'] = etag
+        res.headers['Content-Length'] = str(asset['size'])
+        return res
+
+    web_server.route(url)(send_asset)
+
+
+if diag.TIMING:
+    @web_server.before_request
+    def _start_timer(request):
+        request.g.start_us = time.ticks_us()
+
+    @web_server.after_request
+    def _account_request(request, response):
+        # """
+        # Route latency. Streamed body, e.g. template, is timed up to its last chunk.
+        # """
+        h = diag.histogram('http_request', labels=f'route="{request.path}"')
+        if hasattr(response.body, '__next__'):
+            response.body = _timed_body(h, request.g.start_us, response.body)
+        else:
+            h.add(time.ticks_diff(time.ticks_us(), request.g.start_us))
+        return response
+
+
+def _timed_body(h: diag.Histogram, start_us: int, body):
+    try:
+        yield from body
+    finally:
+        h.add(time.ticks_diff(time.ticks_us(), start_us))
 
 
 add_file_route('index.html', '/')
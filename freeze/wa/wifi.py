@@ -0,0 +1,100 @@
+import asyncio
+import json
+import network
+import time
+import ubinascii
+
+
+CACHE_PATH = 'wifi.json'  # last access point
+POLL_MS = 250
+FAST_CONNECT_TIMEOUT_MS = 4000
+_FAILED = (network.STAT_WRONG_PASSWORD, network.STAT_NO_AP_FOUND, network.STAT_CONNECT_FAIL)
+
+
+def _load_cache() -> dict:
+    try:
+        with open(CACHE_PATH, encoding='utf8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache: dict):
+    if cache == _load_cache():
+        return  # spare flash
+
+    with open(CACHE_PATH, 'w', encoding='utf8') as f:
+        json.dump(cache, f)
+
+
+async def _wait_connected(nic: network.WLAN, status_led, timeout_ms: int = None) -> bool:
+    # """
+    # Wait for association and IP address, blinking status LED
+
+    # :param timeout_ms: give up after, ms. Wait forever if None.
+    # :return: connected
+    # """
+    start = time.ticks_ms()
+    while not nic.isconnected():
+        if timeout_ms is not None and (
+            nic.status() in _FAILED or time.ticks_diff(time.ticks_ms(), start) > timeout_ms
+        ):
+            return False
+
+        status_led.value(not status_led.value())
+        await asyncio.sleep_ms(POLL_MS)
+
+    return True
+
+
+async def _cache_access_point(nic: network.WLAN, ssid: str, idle):
+    # """
+    # Find the strongest access point of the network and save it for the next boot.
+    # Channels scan blocks the event loop for a second or more, so it waits for idle motors.
+
+    # :param idle: callable telling that no motor runs, None to scan at once
+    # """
+    while idle is not None and not idle():
+        await asyncio.sleep_ms(POLL_MS)
+
+    bssid = None
+    rssi = -1000
+    for ap_ssid, ap_bssid, _, ap_rssi, *_ in nic.scan():
+        if ap_ssid == ssid.encode() and ap_rssi > rssi:
+            bssid, rssi = ap_bssid, ap_rssi
+
+    if bssid:
+        _save_cache({'ssid': ssid, 'bssid': ubinascii.hexlify(bssid).decode()})
+
+
+async def connect(ssid: str, password: str, status_led, idle=None) -> tuple:
+    # """
+    # Connect station interface. Access point known from previous boot is reused, which skips
+    # channels scan. Otherwise WiFi stack searches the network in background, the access point
+    # is cached later. Address is always leased by DHCP: a reused lease may be given to another host.
+
+    # :param ssid: network name
+    # :param password: network password
+    # :param status_led: LED blinking while connecting
+    # :param idle: callable telling that no motor runs, access point caching scan waits for it
+    # :return: IP config
+    # """
+    nic = network.WLAN(network.STA_IF)
+    nic.active(True)
+
+    cache = _load_cache()
+    if cache.get('ssid') == ssid and 'bssid' in cache:
+        nic.connect(ssid, password, bssid=ubinascii.unhexlify(cache['bssid']))
+        if await _wait_connected(nic, status_led, FAST_CONNECT_TIMEOUT_MS):
+            status_led.off()
+            return nic.ifconfig()
+
+        print('Cached WiFi access point is stale')
+        nic.disconnect()
+
+    nic.connect(ssid, password)
+    await _wait_connected(nic, status_led)
+    status_led.off()
+
+    asyncio.create_task(_cache_access_point(nic, ssid, idle))
+    return nic.ifconfig()
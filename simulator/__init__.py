@@ -0,0 +1,38 @@
+# Host-side hardware simulator. Runs the firmware on CPython against modelled Wemos D1 mini,
+# TB6612FNG driver, window gearbox with potentiometer and a local MQTT broker.
+
+import math
+import os
+import sys
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPY_PATH = os.path.join(PROJECT_DIR, 'simulator', 'upy')  # MicroPython modules stand-ins
+FIRMWARE_PATHS = (
+    os.path.join(PROJECT_DIR, 'freeze'),
+    os.path.join(PROJECT_DIR, 'ext_modules', 'microdot', 'src'),
+    os.path.join(PROJECT_DIR, 'ext_modules', 'utemplate'),
+)
+
+
+def install(speed: float = math.inf, trace_heap: bool = False):
+    # """
+    # Make firmware importable on CPython: put stand-ins and firmware sources on import path,
+    # switch time module to simulated clock, add MicroPython gc functions.
+
+    # :param speed: simulation speed relative to real time, math.inf to run as fast as possible
+    # :param trace_heap: make gc.mem_alloc() follow real allocations
+    # :return: simulated board
+    # """
+    from simulator.board import board
+    from simulator.clock import patch_time
+    from simulator.heap import patch_gc
+
+    board.clock.speed = speed
+    for path in reversed((UPY_PATH, *FIRMWARE_PATHS)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    patch_time(board.clock)
+    patch_gc(trace_heap)
+
+    return board
@@ -0,0 +1,34 @@
+# TI ADS1115 external ADC model: single-shot conversions of board ADC inputs named 'ads1115:<input>'
+
+from simulator.board import Board
+
+
+class ADS1115Model:
+    # """
+    # I2C device model. Conversions complete instantly, full scale is u16 reading of the input.
+    # """
+
+    def __init__(self, board: Board, address: int = 0x48):
+        # """
+        # :param board: simulated board
+        # :param address: I2C address
+        # """
+        self._board = board
+        self._config = 0x8583  # power-up default
+        self._conversion = 0
+        board.i2c[address] = self
+
+    def writeto_mem(self, reg: int, data: bytes):
+        if reg != 1:
+            return  # threshold registers aren't modelled
+
+        self._config = data[0] << 8 | data[1]
+        if self._config & 0x8000 and self._config & 0x4000:
+            # single-shot conversion of single-ended input
+            channel = self._config >> 12 & 3
+            self._conversion = self._board.adc_read(f'ads1115:{channel}') >> 1
+
+    def readfrom_mem_into(self, reg: int, buf):
+        val = self._conversion if reg == 0 else self._config | 0x8000  # conversion is always done
+        buf[0] = val >> 8 & 0xFF
+        buf[1] = val & 0xFF
@@ -0,0 +1,430 @@
+# Benchmark suite: servo control quality and cost on scripted scenarios, MQTT command round-trip
+# and page render time of the whole firmware. Results are JSON, comparable against a baseline.
+#
+#   python -m simulator.bench --out baseline.json
+#   python -m simulator.bench --compare baseline.json
+
+import argparse
+import asyncio
+import contextlib
+import http.client
+import json
+import math
+import os
+import sys
+import threading
+import tracemalloc
+
+import simulator
+from simulator.board import board
+from simulator.clock import VirtualTimeEventLoop, _real_clock, _real_sleep
+
+
+WINDOW_CLOSED = 0.24  # potentiometer positions of window ends, as in default settings
+WINDOW_OPENED = 0.81
+SAMPLE_S = 0.005  # motion observation step
+IDLE_S = 2  # motor off that long after last command means settled
+TIMEOUT_S = 60
+RUNDOWN_TAU_S = 0.25  # slow gearbox run-down time constant
+
+# name -> start position, (time, target) commands, plant parameters
+SERVO_SCENARIOS = {
+    'full_open': (0., ((0, 1.),), {}),
+    'full_close': (1., ((0, 0.),), {}),
+    'small_step_up': (0.5, ((0, 0.55),), {}),
+    'small_step_down': (0.5, ((0, 0.47),), {}),
+    'retarget': (0., ((0, 1.), (3, 0.2), (5, 0.6)), {}),
+    'stall': (0.1, ((0, 1.),), {'jam_at': 2.}),
+    'noisy_sensor': (0.2, ((0, 0.8),), {'adc_noise': 6.}),
+    # gearbox running down slowly when unpowered, where on/off control overshoots and hunts
+    'rundown_full_open': (0., ((0, 1.),), {'coast_tau': RUNDOWN_TAU_S}),
+    'rundown_small_step': (0.5, ((0, 0.55),), {'coast_tau': RUNDOWN_TAU_S}),
+    'rundown_steps': (0.5, ((0, 0.6), (4, 0.4), (8, 0.6)), {'coast_tau': RUNDOWN_TAU_S}),  # run-down is known
+}
+SERVO_MODES = ('on_off', 'profile')
+
+# HTTP load: concurrent clients fetching pages while the window moves
+LOAD_CLIENTS = 8
+LOAD_S = 10
+LOAD_PAGES = ('/', '/style.css', '/wa.ico', '/window.html', '/movement.html', '/metrics')
+CONTROL_JITTER_BOUND_MS = 20  # control tick lateness p95 under load, one control period
+
+# metrics measured in host real time, noisy by nature
+TIMING_METRICS = ('ticks_per_s', 'rtt_ms', 'render_ms', 'control_jitter_ms', 'requests_per_s', 'rejected_per_s',
+                  'dropped_per_s')
+HIGHER_IS_BETTER = ('ticks_per_s', 'requests_per_s')
+
+
+def _relative(pos: float) -> float:
+    return (pos - WINDOW_CLOSED) / (WINDOW_OPENED - WINDOW_CLOSED)
+
+
+def servo_scenario(start: float, script: tuple, profile: bool, adc_noise: float = 1.5,
+                   coast_tau: float = 0.04, jam_at: float = None, seed: int = 1) -> dict:
+    # """
+    # Drive Servo, Motor and PositionSensor on simulated plant through commands script
+
+    # :param start: initial window position [0-1]
+    # :param script: (time, target position) commands
+    # :param profile: motion profile mode
+    # :param adc_noise: potentiometer noise, ADC counts
+    # :param coast_tau: run-down time constant of unpowered gearbox, s
+    # :param jam_at: block the window at given time
+    # :param seed: sensor noise seed
+    # :return: metrics
+    # """
+    from machine import Pin, Signal
+    from simulator.plant import WindowPlant
+    from wa.servo import Motor, PositionSensor, Servo
+
+    board.reset()
+    board.detach_all()
+    plant = WindowPlant(
+        board,
+        position=WINDOW_CLOSED + start * (WINDOW_OPENED - WINDOW_CLOSED),
+        adc_noise=adc_noise,
+        coast_tau=coast_tau,
+        seed=seed
+    )
+    led = Signal(2, Pin.OPEN_DRAIN, invert=True)
+    motor = Motor(Pin(13, Pin.OUT), Pin(15, Pin.OUT), Pin(4, Pin.OUT), led, power=1, min_power=0.2)
+    sensor = PositionSensor(WINDOW_CLOSED, WINDOW_OPENED, filter_type=PositionSensor.FILTER_MEDIAN, samples=7)
+    servo = Servo(motor, sensor, led, profile=profile)
+
+    # control tick cost: host CPU time and CPython heap peak
+    cost = {'cpu_s': 0., 'ticks': 0, 'peak_b': 0}
+    tick = servo.tick
+
+    def measured_tick():
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        t = _real_clock()
+        tick()
+        cost['cpu_s'] += _real_clock() - t
+        cost['peak_b'] += tracemalloc.get_traced_memory()[1] - before
+        cost['ticks'] += 1
+
+    servo.tick = measured_tick
+
+    res = {'reversals': 0, 'overshoot': 0.}
+
+    async def observe():
+        task = asyncio.create_task(servo.run())
+        t0 = board.clock.now()
+        commands = list(script)
+        target = None
+        last_cmd = last_move = t0
+        last_dir = 0
+        towards = 0  # travel direction of the last command
+        jam_time = None
+        while True:
+            now = board.clock.now()
+            if commands and now - t0 >= commands[0][0]:
+                target = commands.pop(0)[1]
+                servo.position = target
+                towards = 1 if target > _relative(plant.position) else -1
+                last_cmd = last_move = now
+                res['overshoot'] = 0.
+            if jam_at is not None and jam_time is None and now - t0 >= jam_at:
+                plant.jammed = True
+                jam_time = now
+
+            direction = motor.direction
+            if direction:
+                if last_dir and direction != last_dir:
+                    res['reversals'] += 1
+                last_dir = direction
+                last_move = now
+            # overshoot past the last target
+            res['overshoot'] = max(res['overshoot'], (_relative(plant.position) - target) * towards)
+
+            if servo.stalled:
+                res['stall_detect_s'] = round(now - jam_time, 3) if jam_time is not None else -1
+                break
+            if not commands and (now - last_move > IDLE_S or now - t0 > TIMEOUT_S):
+                break
+            await asyncio.sleep(SAMPLE_S)
+
+        res['settle_s'] = round(last_move - last_cmd, 3)
+        res['error'] = round(abs(_relative(plant.position) - target), 4)
+        res['overshoot'] = round(max(0., res['overshoot']), 4)
+        task.cancel()
+
+    loop = VirtualTimeEventLoop(board.clock)
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(observe())
+        loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(loop), return_exceptions=True))
+    finally:
+        loop.close()
+
+    res['ticks'] = cost['ticks']
+    res['ticks_per_s'] = round(cost['ticks'] / cost['cpu_s']) if cost['cpu_s'] else 0
+    res['heap_peak_per_tick_b'] = round(cost['peak_b'] / cost['ticks'], 1) if cost['ticks'] else 0
+    return res
+
+
+def servo_benchmarks() -> dict:
+    # """
+    # All servo scenarios in both control modes
+    # """
+    results = {}
+    for name, (start, script, plant_params) in SERVO_SCENARIOS.items():
+        for mode in SERVO_MODES:
+            results[f'{name}/{mode}'] = servo_scenario(start, script, mode == 'profile', **plant_params)
+    return results
+
+
+def _percentile(values: list, p: int) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, math.ceil(len(values) * p / 100) - 1)]
+
+
+def _summary(values: list) -> dict:
+    if not values:
+        return {'mean': None, 'p95': None, 'max': None}
+    return {
+        'mean': round(sum(values) / len(values), 2),
+        'p95': round(_percentile(values, 95), 2),
+        'max': round(max(values), 2),
+    }
+
+
+def system_benchmarks(commands: int = 10, renders: int = 10, http_port: int = 18180) -> dict:
+    # """
+    # Boot the whole firmware in real time and measure MQTT command round-trip
+    # (set position to reported motion state) and page render time
+
+    # :param commands: MQTT commands to send
+    # :param renders: requests per page
+    # :param http_port: firmware web server port
+    # :return: metrics
+    # """
+    from simulator.broker import MQTTBroker
+    from simulator.plant import WindowPlant
+    from simulator import run
+
+    board.clock.set_speed(1)
+    board.reset()
+    board.detach_all()
+    broker = MQTTBroker().start()
+    root = run.prepare_root(None, broker)
+    os.chdir(root)
+    sys.path.insert(0, root)
+    WindowPlant(board, seed=1)
+
+    topic_base = 'Household/window/wa_sim_window'
+    states = []  # (real time, state)
+    state_changed = threading.Condition()
+
+    def on_state(topic, payload):
+        with state_changed:
+            states.append((_real_clock(), payload.decode()))
+            state_changed.notify_all()
+
+    def wait_state(accept, timeout: float = 30) -> float:
+        with state_changed:
+            ok = state_changed.wait_for(lambda: states and states[-1][1] in accept, timeout)
+        if not ok:
+            raise TimeoutError(f'no {accept} state')
+        return states[-1][0]
+
+    broker.observe(topic_base + '/state/notify', on_state)
+    results = {}
+    done = threading.Event()
+
+    def client():
+        try:
+            wait_state(('stopped',))
+            rtt = []
+            for i in range(commands):
+                wait_state(('stopped',))
+                _real_sleep(0.2)
+                with state_changed:
+                    states.clear()
+                t = _real_clock()
+                broker.publish(topic_base + '/position/set', str(40 + 20 * (i % 2)))
+                rtt.append((wait_state(('opening', 'closing')) - t) * 1000)
+            results['mqtt_command'] = {'rtt_ms': _summary(rtt)}
+
+            for page in ('/window.html', '/network.html', '/movement.html'):
+                times = []
+                for _ in range(renders):
+                    conn = http.client.HTTPConnection('127.0.0.1', http_port, timeout=10)
+                    t = _real_clock()
+                    conn.request('GET', page)
+                    conn.getresponse().read()
+                    times.append((_real_clock() - t) * 1000)
+                    conn.close()
+                results[f'http_get{page}'] = {'render_ms': _summary(times)}
+
+            results['http_load'] = http_load(http_port, lambda i: broker.publish(
+                topic_base + '/position/set', str(20 + 60 * (i % 2))
+            ))
+        finally:
+            done.set()
+
+    threading.Thread(target=client, daemon=True).start()
+    try:
+        run.run(http_port=http_port, stop=done)
+    finally:
+        broker.stop()
+        board.clock.set_speed(math.inf)
+
+    return results
+
+
+def http_load(http_port: int, command, clients: int = LOAD_CLIENTS, duration: float = LOAD_S) -> dict:
+    # """
+    # Fetch pages from concurrent keep-alive clients while the window moves back and forth,
+    # measure control loop jitter meanwhile
+
+    # :param http_port: firmware web server port
+    # :param command: callable(i) sending i-th movement command
+    # :param clients: concurrent clients
+    # :param duration: load time, s
+    # :return: metrics
+    # """
+    from wa import diag
+    from wa.web import web_server
+
+    jitter = diag.histogram('control_jitter', 'ms')
+    for i in range(jitter.BUCKETS):
+        jitter.counts[i] = 0
+    jitter.count = jitter.total = jitter.carries = jitter.max = 0
+    rejected = web_server.rejected
+
+    statuses = {}
+    end = _real_clock() + duration
+
+    def client():
+        conn = None
+        i = 0
+        while _real_clock() < end:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', http_port, timeout=10)
+            try:
+                conn.request('GET', LOAD_PAGES[i % len(LOAD_PAGES)])
+                res = conn.getresponse()
+                res.read()
+                statuses[res.status] = statuses.get(res.status, 0) + 1
+                if res.will_close:
+                    conn.close()
+                    conn = None
+            except (OSError, http.client.HTTPException):
+                statuses['error'] = statuses.get('error', 0) + 1
+                conn.close()
+                conn = None
+            i += 1
+        if conn:
+            conn.close()
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    i = 0
+    while _real_clock() < end:
+        command(i)
+        i += 1
+        _real_sleep(3)
+    for t in threads:
+        t.join()
+
+    # dropped are idle keep-alive connections evicted in favour of new ones, browsers retry such requests
+    served = sum(n for status, n in statuses.items() if status in (200, 304))
+    return {
+        'control_jitter_ms': {
+            'p50': jitter.percentile(50),
+            'p95': jitter.percentile(95),
+            'max': jitter.max,
+        },
+        'requests_per_s': round(served / duration, 1),
+        'rejected_per_s': round((web_server.rejected - rejected) / duration, 1),
+        'dropped_per_s': round(statuses.get('error', 0) / duration, 1),
+    }
+
+
+def _flatten(results: dict) -> dict:
+    flat = {}
+    for section, entries in results.items():
+        for entry, metrics in entries.items():
+            for metric, val in metrics.items():
+                if isinstance(val, dict):
+                    for stat, v in val.items():
+                        flat[f'{section}/{entry}/{metric}.{stat}'] = v
+                else:
+                    flat[f'{section}/{entry}/{metric}'] = val
+    return flat
+
+
+def compare(results: dict, baseline: dict, tolerance: float, timing_tolerance: float) -> list:
+    # """
+    # Print metrics against baseline
+
+    # :param results: current results
+    # :param baseline: baseline results
+    # :param tolerance: allowed relative worsening of simulated metrics
+    # :param timing_tolerance: allowed relative worsening of host timing metrics
+    # :return: regressed metric names
+    # """
+    cur = _flatten(results)
+    base = _flatten(baseline)
+    regressions = []
+    print(f'{"metric":64} {"baseline":>10} {"current":>10} {"change":>8}')
+    for key in sorted(set(cur) | set(base)):
+        old = base.get(key)
+        new = cur.get(key)
+        if old is None or new is None:
+            print(f'{key:64} {str(old):>10} {str(new):>10}')
+            continue
+
+        metric = key.split('/')[-1].split('.')[0]
+        worse = old - new if metric in HIGHER_IS_BETTER else new - old
+        limit = timing_tolerance if metric in TIMING_METRICS else tolerance
+        change = f'{(new - old) / abs(old) * 100:+.0f}%' if old else ('0%' if old == new else 'new')
+        regressed = worse > abs(old) * limit and worse > 1e-3
+        if regressed:
+            regressions.append(key)
+        print(f'{key:64} {old:>10} {new:>10} {change:>8}{"  REGRESSION" if regressed else ""}')
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Window Actuator benchmarks on simulated hardware')
+    parser.add_argument('--out', help='write results JSON to file (default: stdout)')
+    parser.add_argument('--compare', help='baseline results JSON, exit with 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='allowed worsening of simulated metrics')
+    parser.add_argument('--timing-tolerance', type=float, default=0.5, help='allowed worsening of host timings')
+    parser.add_argument('--skip-system', action='store_true', help='servo scenarios only')
+    args = parser.parse_args()
+
+    simulator.install(trace_heap=True)
+    with contextlib.redirect_stdout(sys.stderr):  # firmware logs, stdout is left to the report
+        results = {'servo': servo_benchmarks()}
+        tracemalloc.stop()  # don't slow down real time part
+        if not args.skip_system:
+            results['system'] = system_benchmarks()
+    if not args.skip_system:
+        jitter = results['system']['http_load']['control_jitter_ms']['p95']
+        if jitter > CONTROL_JITTER_BOUND_MS:
+            print(f'control jitter p95 {jitter} ms under HTTP load exceeds {CONTROL_JITTER_BOUND_MS} ms',
+                  file=sys.stderr)
+            sys.exit(1)
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf8') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    elif not args.compare:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        print()
+
+    if args.compare:
+        with open(args.compare, encoding='utf8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance, args.timing_tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
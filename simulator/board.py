@@ -0,0 +1,94 @@
+from simulator.clock import VirtualClock
+
+
+class Reset(SystemExit):
+    # """
+    # machine.reset() was called. Derived from SystemExit to pass through firmware `except Exception` blocks
+    # and asyncio exception handler.
+    # """
+    pass
+
+
+class Board:
+    # """
+    # Simulated Wemos D1 mini: GPIO levels, PWM channels, ADC inputs and WiFi environment
+    # """
+
+    def __init__(self):
+        self.clock = VirtualClock()
+        self.pins = {}  # GPIO number -> machine.Pin
+        self.pwms = {}  # GPIO number -> machine.PWM
+        self.adcs = {}  # ADC channel -> callable returning u16 reading
+        self.i2c = {}  # I2C address -> device model with writeto_mem() and readfrom_mem_into()
+        self._models = []
+
+        # WiFi environment
+        self.wifi_available = True
+        self.wifi_ssid = 'simulated'
+        self.wifi_bssid = b'\x10\xfe\xed\x00\x00\x01'
+        self.wifi_channel = 6
+        self.wifi_scan_s = 1.5  # all channels scan, skipped when connecting to known BSSID
+        self.wifi_assoc_s = 0.5  # authentication and association time
+        self.wifi_dhcp_s = 0.5  # DHCP lease time, skipped with static IP config
+        self.wifi_ifconfig = ('192.168.1.50', '255.255.255.0', '192.168.1.1', '192.168.1.1')
+        self.mac = b'\x5c\xcf\x7f\x00\xa1\xb2'
+
+    def attach(self, model):
+        # """
+        # Connect physical model. Model must provide update(now: float) method.
+
+        # :param model: physical model driven by board outputs
+        # """
+        self._models.append(model)
+
+    def detach_all(self):
+        # """
+        # Disconnect all physical models
+        # """
+        self._models.clear()
+        self.adcs.clear()
+        self.i2c.clear()
+
+    def sync(self):
+        # """
+        # Bring physical models to current time. Called before any output change, so models integrate
+        # piecewise constant inputs exactly.
+        # """
+        now = self.clock.now()
+        for model in self._models:
+            model.update(now)
+
+    def pin_level(self, pin_id: int) -> int:
+        # """
+        # Output level of GPIO, 0 if pin is not configured
+        # """
+        pin = self.pins.get(pin_id)
+        return pin.value() if pin else 0
+
+    def pwm_duty(self, pin_id: int) -> int:
+        # """
+        # PWM duty of GPIO [0-65535]. Pin without PWM is 0% or 100% depending on its level.
+        # """
+        pwm = self.pwms.get(pin_id)
+        if pwm is None:
+            return 65535 * self.pin_level(pin_id)
+
+        return pwm.duty_u16()
+
+    def adc_read(self, channel: int) -> int:
+        # """
+        # Sample ADC input [0-65535]
+        # """
+        self.sync()
+        source = self.adcs.get(channel)
+        return source() if source else 0
+
+    def reset(self):
+        # """
+        # Forget firmware created peripherals, physical models keep their state
+        # """
+        self.pins.clear()
+        self.pwms.clear()
+
+
+board = Board()  # the simulated device
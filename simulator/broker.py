@@ -0,0 +1,234 @@
+import asyncio
+import struct
+import threading
+
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    # """
+    # MQTT topic filter match with `+` and `#` wildcards
+    # """
+    pat = pattern.split('/')
+    top = topic.split('/')
+    for i, p in enumerate(pat):
+        if p == '#':
+            return True
+        if i >= len(top) or (p != '+' and p != top[i]):
+            return False
+
+    return len(pat) == len(top)
+
+
+class _Session:
+    # """
+    # Connected client
+    # """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.client_id = None
+        self.subscriptions = set()
+
+    def send(self, packet_type: int, payload: bytes = b''):
+        size = len(payload)
+        length = bytearray()
+        while True:
+            b = size & 0x7F
+            size >>= 7
+            length.append(b | (0x80 if size else 0))
+            if not size:
+                break
+        self.writer.write(bytes((packet_type,)) + length + payload)
+
+    def send_publish(self, topic: bytes, payload: bytes, retain: bool):
+        self.send(0x30 | retain, struct.pack('!H', len(topic)) + topic + payload)
+
+
+class MQTTBroker:
+    # """
+    # Minimal MQTT 3.1.1 broker (QoS 0/1, retained messages, wildcards) running in a background thread.
+    # Local stand-in for the Home Assistant broker.
+    # """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        # """
+        # :param host: listen address
+        # :param port: listen port, 0 to pick a free one
+        # """
+        self.host = host
+        self.port = port
+        self.retained = {}  # topic -> payload
+        self.published = 0  # count of PUBLISH packets received from clients
+        self._sessions = set()
+        self._observers = []  # (topic filter, callback)
+        self._loop: asyncio.AbstractEventLoop = None
+        self._server = None
+        self._started = threading.Event()
+
+    # --- host side API, thread safe ---
+
+    def start(self) -> 'MQTTBroker':
+        # """
+        # Start serving in background thread
+        # """
+        threading.Thread(target=self._thread, name='mqtt-broker', daemon=True).start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        # """
+        # Drop all clients and stop serving
+        # """
+        self._call(self._shutdown)
+
+    def publish(self, topic: str, payload, retain: bool = False):
+        # """
+        # Publish message to subscribed clients
+
+        # :param topic: topic
+        # :param payload: message body
+        # :param retain: keep message for future subscribers
+        # """
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self._call(self._route, topic.encode(), payload, retain)
+
+    def observe(self, topic_filter: str, callback):
+        # """
+        # Watch messages published by clients. Callback is called in broker thread.
+
+        # :param topic_filter: topic filter, may contain wildcards
+        # :param callback: callable(topic: str, payload: bytes)
+        # """
+        self._observers.append((topic_filter, callback))
+
+    def disconnect_all(self):
+        # """
+        # Close all client connections, e.g. to simulate broker restart
+        # """
+        self._call(self._disconnect_all)
+
+    @property
+    def clients(self) -> int:
+        return len(self._sessions)
+
+    # --- broker thread ---
+
+    def _call(self, func, *args):
+        self._loop.call_soon_threadsafe(func, *args)
+
+    def _thread(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._serve())
+        self._loop.run_forever()
+
+    async def _serve(self):
+        self._server = await asyncio.start_server(self._client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+
+    def _shutdown(self):
+        self._server.close()
+        self._disconnect_all()
+
+    def _disconnect_all(self):
+        for session in list(self._sessions):
+            session.writer.close()
+        self._sessions.clear()
+
+    def _route(self, topic: bytes, payload: bytes, retain: bool):
+        topic_str = topic.decode()
+        if retain:
+            if payload:
+                self.retained[topic_str] = payload
+            else:
+                self.retained.pop(topic_str, None)
+
+        for session in list(self._sessions):
+            if any(topic_matches(f, topic_str) for f in session.subscriptions):
+                session.send_publish(topic, payload, False)
+
+        for topic_filter, callback in self._observers:
+            if topic_matches(topic_filter, topic_str):
+                callback(topic_str, payload)
+
+    async def _read_packet(self, reader: asyncio.StreamReader):
+        header = (await reader.readexactly(1))[0]
+        size = 0
+        shift = 0
+        while True:
+            b = (await reader.readexactly(1))[0]
+            size |= (b & 0x7F) << shift
+            if not b & 0x80:
+                break
+            shift += 7
+
+        return header, await reader.readexactly(size)
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = _Session(reader, writer)
+        try:
+            header, body = await self._read_packet(reader)
+            if header != 0x10:
+                return
+
+            id_len = struct.unpack_from('!H', body, 10)[0]
+            session.client_id = body[12:12 + id_len].decode()
+            self._sessions.add(session)
+            session.send(0x20, b'\x00\x00')
+
+            while True:
+                header, body = await self._read_packet(reader)
+                kind = header & 0xF0
+
+                if kind == 0x30:  # PUBLISH
+                    qos = (header >> 1) & 3
+                    topic_len = struct.unpack_from('!H', body)[0]
+                    topic = body[2:2 + topic_len]
+                    pos = 2 + topic_len
+                    if qos:
+                        session.send(0x40, body[pos:pos + 2])
+                        pos += 2
+                    self.published += 1
+                    self._route(topic, body[pos:], bool(header & 1))
+
+                elif kind == 0x80:  # SUBSCRIBE
+                    pid = body[:2]
+                    pos = 2
+                    granted = bytearray()
+                    new_filters = []
+                    while pos < len(body):
+                        flt_len = struct.unpack_from('!H', body, pos)[0]
+                        flt = body[pos + 2:pos + 2 + flt_len].decode()
+                        pos += 3 + flt_len
+                        session.subscriptions.add(flt)
+                        new_filters.append(flt)
+                        granted.append(0)
+                    session.send(0x90, pid + granted)
+                    for topic, payload in list(self.retained.items()):
+                        if any(topic_matches(f, topic) for f in new_filters):
+                            session.send_publish(topic.encode(), payload, True)
+
+                elif kind == 0xA0:  # UNSUBSCRIBE
+                    pid = body[:2]
+                    pos = 2
+                    while pos < len(body):
+                        flt_len = struct.unpack_from('!H', body, pos)[0]
+                        session.subscriptions.discard(body[pos + 2:pos + 2 + flt_len].decode())
+                        pos += 2 + flt_len
+                    session.send(0xB0, pid)
+
+                elif kind == 0xC0:  # PINGREQ
+                    session.send(0xD0)
+
+                elif kind == 0xE0:  # DISCONNECT
+                    return
+
+                await writer.drain()
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        finally:
+            self._sessions.discard(session)
+            writer.close()
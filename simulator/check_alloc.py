@@ -0,0 +1,74 @@
+# Steady-state control ticks must not allocate: host-side check that servo ticks keep no memory allocated
+# by firmware code, compared by tracemalloc snapshots around a series of ticks, for both control modes and
+# all position filters.
+# CPython boxes ints above 256 while expressions are evaluated, so transient allocations are left to
+# firmware/check_alloc_device.py on the device, memory kept by ticks (growing buffers, cached objects) is caught here.
+#
+#   python -m simulator.check_alloc
+
+import gc
+import os
+import sys
+import tracemalloc
+
+import simulator
+from simulator.board import board
+
+
+WARMUP_TICKS = 500  # fill velocity estimator, wrap trace ring: counters leave CPython small int cache
+TICKS = 500
+FILTERS = ('FILTER_NONE', 'FILTER_MEDIAN', 'FILTER_EMA')
+
+
+def retained(profile: bool, filter_type: int) -> int:
+    # """
+    # Bytes kept by steady-state ticks of servo moving to far target
+    # """
+    from machine import Pin, Signal
+    from firmware.idle_motor import IdleMotor
+    from simulator.plant import WindowPlant
+    from wa.servo import PositionSensor, Servo
+
+    board.reset()
+    board.detach_all()
+    WindowPlant(board, position=0.5, seed=1)
+    led = Signal(2, Pin.OPEN_DRAIN, invert=True)
+    sensor = PositionSensor(0.24, 0.81, filter_type=filter_type, samples=7)
+    srv = Servo(IdleMotor(), sensor, led, stall_speed=-65535, profile=profile)  # never stalls
+    srv.position = 1 if sensor.position < 0.5 else 0
+    period_s = Servo.CONTROL_PERIOD_MS / 1000
+
+    for _ in range(WARMUP_TICKS):
+        board.clock.advance(period_s)
+        srv._step()
+
+    firmware = [tracemalloc.Filter(True, os.path.join(simulator.FIRMWARE_PATHS[0], '*'))]
+    gc.collect()  # previous cases' garbage isn't freed meanwhile
+    before = tracemalloc.take_snapshot().filter_traces(firmware)
+    for _ in range(TICKS):
+        board.clock.advance(period_s)
+        srv._step()
+    after = tracemalloc.take_snapshot().filter_traces(firmware)
+    return sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+
+def main():
+    simulator.install(trace_heap=True)
+    from wa.servo import PositionSensor
+
+    failed = 0
+    for profile in (False, True):
+        for filter_name in FILTERS:
+            delta = retained(profile, getattr(PositionSensor, filter_name))
+            ok = delta == 0
+            failed += not ok
+            mode = 'profile' if profile else 'on/off'
+            print(f'{"PASS" if ok else "FAIL"} {mode} {filter_name}: {delta} B kept by {TICKS} ticks')
+
+    if failed:
+        print(f'{failed} cases allocate in steady state', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import asyncio
+import math
+import selectors
+import time
+
+
+TICKS_PERIOD = 1 << 30  # MicroPython ports wrap ticks_ms/ticks_us at 2**30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+_real_sleep = time.sleep
+_real_clock = time.perf_counter
+
+
+class VirtualClock:
+    # """
+    # Simulation time source. With infinite speed the time advances only when firmware waits,
+    # otherwise it is the real time scaled by speed factor.
+    # """
+
+    EPOCH = 1_700_000_000  # time.time() at simulated power-up
+
+    def __init__(self, speed: float = math.inf):
+        # """
+        # :param speed: simulation speed relative to real time, math.inf to run as fast as possible
+        # """
+        self.speed = speed
+        self._virtual = 0.
+        self._real = _real_clock()
+
+    @property
+    def realtime(self) -> bool:
+        # """
+        # Clock follows (scaled) real time
+        # """
+        return self.speed != math.inf
+
+    def now(self) -> float:
+        # """
+        # Seconds since simulated power-up
+        # """
+        if self.realtime:
+            return self._virtual + (_real_clock() - self._real) * self.speed
+
+        return self._virtual
+
+    def set_speed(self, speed: float):
+        # """
+        # Change simulation speed keeping current time
+
+        # :param speed: simulation speed relative to real time, math.inf to run as fast as possible
+        # """
+        self._virtual = self.now()
+        self._real = _real_clock()
+        self.speed = speed
+
+    def advance(self, interval: float):
+        # """
+        # Move time forward without real waiting. Only used in as-fast-as-possible mode.
+
+        # :param interval: time step, s
+        # """
+        if interval > 0:
+            self._virtual += interval
+
+    def sleep(self, interval: float):
+        # """
+        # Blocking sleep
+
+        # :param interval: sleep interval, s
+        # """
+        if interval <= 0:
+            return
+
+        if self.realtime:
+            _real_sleep(interval / self.speed)
+        else:
+            self.advance(interval)
+
+
+class VirtualTimeSelector(selectors.DefaultSelector):
+    # """
+    # Selector which turns event loop idle time into virtual clock advance
+    # """
+
+    IO_GRACE_S = 0.0002  # real time to wait for socket data before skipping the virtual time forward
+
+    def __init__(self, clock: VirtualClock):
+        super().__init__()
+        self._clock = clock
+
+    def select(self, timeout=None):
+        if self._clock.realtime:
+            if timeout is not None:
+                timeout /= self._clock.speed
+            return super().select(timeout)
+
+        if timeout is None:
+            # nothing scheduled, only real I/O can wake the loop
+            return super().select(None)
+
+        events = super().select(min(timeout, self.IO_GRACE_S))
+        if not events:
+            self._clock.advance(timeout)
+
+        return events
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    # """
+    # asyncio event loop running on virtual clock
+    # """
+
+    def __init__(self, clock: VirtualClock):
+        super().__init__(selector=VirtualTimeSelector(clock))
+        self._clock = clock
+
+    def time(self) -> float:
+        return self._clock.now()
+
+
+def ticks_add(ticks: int, delta: int) -> int:
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(ticks1: int, ticks2: int) -> int:
+    return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+
+def patch_time(clock: VirtualClock):
+    # """
+    # Make CPython time and asyncio modules look like MicroPython ones and run on virtual clock
+
+    # :param clock: simulation clock
+    # """
+    time.time = lambda: clock.EPOCH + clock.now()
+    time.sleep = clock.sleep
+    time.sleep_ms = lambda ms: clock.sleep(ms / 1000)
+    time.sleep_us = lambda us: clock.sleep(us / 1_000_000)
+    time.ticks_ms = lambda: int(clock.now() * 1000) & TICKS_MAX
+    time.ticks_us = lambda: int(clock.now() * 1_000_000) & TICKS_MAX
+    time.ticks_cpu = time.ticks_us
+    time.ticks_add = ticks_add
+    time.ticks_diff = ticks_diff
+
+    asyncio.sleep_ms = lambda ms, result=None: asyncio.sleep(ms / 1000, result)
@@ -0,0 +1,307 @@
+# Fleet load test: hundreds of MQTT device instances against the local broker. Measures group command
+# fan-out latency, broker inbound publish rate and reconnection storms after broker restart and power cut.
+# Devices run the firmware MQTT stack (MQTTWindowActuator, MQTTClient) with kinematic servo stand-ins.
+#
+#   python -m simulator.fleet --devices 300 --jitter-ms 2000 --out fleet.json
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+
+import simulator
+from simulator.bench import _summary
+from simulator.board import board
+from simulator.broker import MQTTBroker
+from simulator.clock import VirtualTimeEventLoop, _real_clock
+
+
+POLL_S = 0.01  # fleet state observation step
+SETTLE_S = 3  # no broker traffic that long means fleet is idle
+TIMEOUT_S = 120
+POWER_OFF_S = 0.5
+
+
+class FleetServo:
+    # """
+    # Servo stand-in: moves to target at constant speed, never stalls
+    # """
+
+    SPEED = 0.1  # position per second
+    POSITION_PRECISION = 0.01
+
+    def __init__(self, position: float):
+        self._position = position
+        self._target = None
+        self._t = board.clock.now()
+        self.stalled = False
+        self.commanded = None  # real time of the first movement command
+        self.applied = None
+
+    def _update(self):
+        now = board.clock.now()
+        if self._target is not None:
+            step = self.SPEED * (now - self._t)
+            delta = self._target - self._position
+            self._position = self._target if abs(delta) <= step else self._position + math.copysign(step, delta)
+        self._t = now
+
+    @property
+    def position(self) -> float:
+        self._update()
+        return self._position
+
+    @position.setter
+    def position(self, target: float):
+        self._update()
+        self._target = target
+        if self.commanded is None:
+            self.commanded = _real_clock()
+
+    def request(self, target: float):
+        self.position = target
+        if self.applied:
+            self.applied.set()
+
+    @property
+    def target(self) -> float:
+        return self._target
+
+    @property
+    def running(self) -> bool:
+        return self._target is not None and self.position != self._target
+
+    @property
+    def direction(self) -> int:
+        if not self.running:
+            return 0
+        return 1 if self._target > self._position else -1
+
+    def stop(self):
+        self._update()
+        self._target = None
+
+
+class Device:
+    # """
+    # One fleet member: MQTT actuator of a single window
+    # """
+
+    def __init__(self, num: int, broker: MQTTBroker, groups: tuple, jitter_ms: int, position: float):
+        from wa.mqtt import MQTTWindowActuator
+
+        self.servo = FleetServo(position)
+        self.actuator = MQTTWindowActuator(
+            broker.host, broker.port, '', '',
+            servos=[('window', self.servo)],
+            client_name=f'wa_fleet_{num:04d}',
+            groups=groups,
+            group_jitter_ms=jitter_ms
+        )
+        self.received = None  # real time of the first incoming command
+
+        mqtt = self.actuator._mqtt
+        inbox = mqtt._cb
+
+        def timed_inbox(topic: bytes, msg: bytes):
+            if self.received is None and topic != b'homeassistant/status':
+                self.received = _real_clock()
+            inbox(topic, msg)
+
+        mqtt._cb = timed_inbox
+        asyncio.create_task(self.actuator.run())
+
+
+class Traffic:
+    # """
+    # Broker inbound messages timestamps and first motion state reports of devices
+    # """
+
+    def __init__(self, broker: MQTTBroker):
+        self.times = []
+        self.moving = {}  # client name -> real time of the first opening/closing report
+        broker.observe('#', self._on_message)
+
+    def _on_message(self, topic: str, payload: bytes):
+        if topic.startswith('Household/window/group/'):
+            return  # harness commands
+
+        t = _real_clock()
+        self.times.append(t)
+        if topic.endswith('/state/notify') and payload in (b'opening', b'closing'):
+            self.moving.setdefault(topic.split('/')[2].rsplit('_', 1)[0], t)
+
+    def rates(self, start: float) -> dict:
+        # """
+        # Messages per second since start: mean over active period and peak one-second window
+        # """
+        times = [t for t in self.times if t >= start]
+        if not times:
+            return {'messages': 0, 'mean_per_s': 0, 'peak_per_s': 0}
+
+        peak = 0
+        first = 0
+        for last, t in enumerate(times):
+            while t - times[first] >= 1:
+                first += 1
+            peak = max(peak, last - first + 1)
+        span = max(1., times[-1] - start)
+        return {'messages': len(times), 'mean_per_s': round(len(times) / span, 1), 'peak_per_s': peak}
+
+    async def settled(self, start: float):
+        # """
+        # Wait until no messages arrive for a while
+        # """
+        while _real_clock() - start < TIMEOUT_S:
+            last = self.times[-1] if self.times else start
+            if _real_clock() - max(last, start) > SETTLE_S:
+                return
+            await asyncio.sleep(POLL_S * 10)
+
+
+async def _all_connected(devices: list, start: float) -> list:
+    # """
+    # Wait for all devices to connect
+
+    # :return: connection delays since start, s
+    # """
+    delays = [None] * len(devices)
+    while None in delays and _real_clock() - start < TIMEOUT_S:
+        for i, dev in enumerate(devices):
+            if delays[i] is None and dev.actuator.connected:
+                delays[i] = _real_clock() - start
+        await asyncio.sleep(POLL_S)
+    return [d for d in delays if d is not None]
+
+
+async def _storm(delays: list, devices: int, traffic: Traffic, start: float) -> dict:
+    # """
+    # Reconnection metrics, traffic is counted until it calms down
+    # """
+    await traffic.settled(start)
+    res = {
+        'connected': len(delays),
+        'all_connected_s': round(max(delays), 2) if len(delays) == devices else None,
+        'connect_s': _summary(delays),
+    }
+    res.update(traffic.rates(start))
+    return res
+
+
+def _cancel_devices():
+    current = asyncio.current_task()
+    for task in asyncio.all_tasks():
+        if task is not current:
+            task.cancel()
+
+
+async def _fleet(broker: MQTTBroker, devices: int, floors: int, jitter_ms: int, seed: int) -> dict:
+    rnd = random.Random(seed)
+    positions = [rnd.uniform(0, 0.5) for _ in range(devices)]
+
+    def boot() -> list:
+        return [
+            Device(i, broker, ('all', f'floor{i % floors}'), jitter_ms, positions[i])
+            for i in range(devices)
+        ]
+
+    traffic = Traffic(broker)
+    results = {}
+
+    # whole fleet powered on at once: connections, discovery and initial state
+    start = _real_clock()
+    fleet = boot()
+    results['boot'] = await _storm(await _all_connected(fleet, start), devices, traffic, start)
+
+    # one command to every device
+    start = _real_clock()
+    broker.publish('Household/window/group/all/state/set', 'OPEN')
+    await traffic.settled(start)
+    results['group_command'] = {
+        'delivered': sum(dev.received is not None for dev in fleet),
+        'delivery_ms': _summary([(dev.received - start) * 1000 for dev in fleet if dev.received]),
+        'execution_ms': _summary([(dev.servo.commanded - start) * 1000 for dev in fleet if dev.servo.commanded]),
+        'state_report_ms': _summary([(t - start) * 1000 for t in traffic.moving.values()]),
+    }
+    results['group_command'].update(traffic.rates(start))
+
+    # broker restart: devices keep running and reconnect after backoff
+    start = _real_clock()
+    broker.disconnect_all()
+    while any(dev.actuator.connected for dev in fleet) and _real_clock() - start < TIMEOUT_S:
+        await asyncio.sleep(POLL_S)
+    results['broker_restart'] = await _storm(await _all_connected(fleet, start), devices, traffic, start)
+
+    # power cut: broker and devices go down, devices boot together once power is back
+    _cancel_devices()
+    broker.disconnect_all()
+    await asyncio.sleep(POWER_OFF_S)
+    positions = [dev.servo.position for dev in fleet]
+    start = _real_clock()
+    fleet = boot()
+    results['power_cut'] = await _storm(await _all_connected(fleet, start), devices, traffic, start)
+
+    _cancel_devices()
+    return results
+
+
+def fleet_benchmark(devices: int = 200, floors: int = 10, jitter_ms: int = 0, seed: int = 1,
+                    verbose: bool = False) -> dict:
+    # """
+    # Run fleet in real time against local broker
+
+    # :param devices: fleet size
+    # :param floors: devices are split to this many floor groups besides 'all' group
+    # :param jitter_ms: group commands random delay limit
+    # :param seed: initial positions seed
+    # :param verbose: show devices output
+    # :return: metrics
+    # """
+    board.clock.set_speed(1)
+    random.seed(seed)
+    broker = MQTTBroker().start()
+    os.chdir(tempfile.mkdtemp(prefix='wa_fleet_'))  # shared discovery hashes file
+
+    loop = VirtualTimeEventLoop(board.clock)
+    asyncio.set_event_loop(loop)
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with output:
+            results = loop.run_until_complete(_fleet(broker, devices, floors, jitter_ms, seed))
+            loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(loop), return_exceptions=True))
+    finally:
+        loop.close()
+        broker.stop()
+
+    return {'fleet': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Window Actuator fleet load test against local MQTT broker')
+    parser.add_argument('--devices', type=int, default=200, help='fleet size')
+    parser.add_argument('--floors', type=int, default=10, help='floor groups')
+    parser.add_argument('--jitter-ms', type=int, default=0, help='group commands random delay limit')
+    parser.add_argument('--seed', type=int, default=1, help='initial positions and jitter seed')
+    parser.add_argument('--out', help='write results JSON to file (default: stdout)')
+    parser.add_argument('--verbose', action='store_true', help='show devices output')
+    args = parser.parse_args()
+
+    simulator.install()
+    results = fleet_benchmark(args.devices, args.floors, args.jitter_ms, args.seed, args.verbose)
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf8') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main()
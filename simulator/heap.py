@@ -0,0 +1,24 @@
+import gc
+import tracemalloc
+
+
+HEAP_SIZE = 40 * 1024  # ESP8266 MicroPython heap
+TRACED_HEAP_SIZE = 4 * 1024 * 1024  # room for CPython objects of the same firmware
+
+
+def patch_gc(trace: bool = False):
+    # """
+    # Add MicroPython gc.mem_alloc() and gc.mem_free(). With tracing they follow CPython allocations
+    # made since the patch, which are bigger than MicroPython ones, but show the same trends.
+    # Otherwise the heap looks empty.
+
+    # :param trace: trace allocations with tracemalloc, slows simulation down
+    # """
+    if trace:
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        gc.mem_alloc = lambda: max(0, tracemalloc.get_traced_memory()[0] - base)
+        gc.mem_free = lambda: max(0, TRACED_HEAP_SIZE - gc.mem_alloc())
+    else:
+        gc.mem_alloc = lambda: 0
+        gc.mem_free = lambda: HEAP_SIZE
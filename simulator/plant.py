@@ -0,0 +1,126 @@
+import math
+import random
+
+from simulator.board import Board
+
+
+class WindowPlant:
+    # """
+    # Physical model of the window driven by DC gear motor through TB6612FNG channel,
+    # with potentiometer on the gearbox output axis.
+
+    # Axis position is expressed as potentiometer relative output [0-1]. CW rotation (AIN1 high)
+    # decreases it, which is the closing direction.
+    # """
+
+    MAX_STEP_S = 0.01  # integration step limit
+
+    def __init__(
+            self,
+            board: Board,
+            cw_pin: int = 13,
+            ccw_pin: int = 15,
+            pwm_pin: int = 4,
+            adc_channel=0,
+            position: float = 0.3,
+            max_speed: float = 0.08,
+            dead_duty: float = 0.2,
+            tau: float = 0.12,
+            coast_tau: float = 0.04,
+            stop_low: float = 0.22,
+            stop_high: float = 0.86,
+            adc_noise: float = 1.5,
+            seed: int = None
+    ):
+        # """
+        # :param board: simulated board
+        # :param cw_pin: driver AIN1 GPIO
+        # :param ccw_pin: driver AIN2 GPIO
+        # :param pwm_pin: driver PWMA GPIO
+        # :param adc_channel: ADC channel the potentiometer is wired to, 'ads1115:<input>' for external ADC
+        # :param position: initial axis position [0-1]
+        # :param max_speed: axis speed at full PWM duty and no load, 1/s
+        # :param dead_duty: PWM duty [0-1] below which motor can't overcome friction
+        # :param tau: motor and window inertia time constant, s
+        # :param coast_tau: run-down time constant of unpowered gearbox, s
+        # :param stop_low: mechanical end stop, closed window side
+        # :param stop_high: mechanical end stop, opened window side
+        # :param adc_noise: potentiometer and ADC noise standard deviation, 10-bit ADC counts
+        # :param seed: noise generator seed
+        # """
+        self._board = board
+        self._cw_pin = cw_pin
+        self._ccw_pin = ccw_pin
+        self._pwm_pin = pwm_pin
+
+        self.position = position
+        self.speed = 0.
+        self.max_speed = max_speed
+        self.dead_duty = dead_duty
+        self.tau = tau
+        self.coast_tau = coast_tau
+        self.stop_low = stop_low
+        self.stop_high = stop_high
+        self.adc_noise = adc_noise
+        self.load = 0.  # external load [0-1], 1 stops the motor
+        self.jammed = False  # obstacle blocks the window
+
+        self._rnd = random.Random(seed)
+        self._time = board.clock.now()
+
+        board.attach(self)
+        board.adcs[adc_channel] = self.adc_u16
+
+    @property
+    def drive(self) -> float:
+        # """
+        # Signed motor drive [-1, 1] from driver inputs, positive opens the window
+        # """
+        direction = self._board.pin_level(self._ccw_pin) - self._board.pin_level(self._cw_pin)
+        return direction * self._board.pwm_duty(self._pwm_pin) / 65535
+
+    def _target_speed(self, drive: float) -> float:
+        duty = abs(drive)
+        if duty <= self.dead_duty or self.jammed:
+            return 0.
+
+        speed = self.max_speed * (duty - self.dead_duty) / (1 - self.dead_duty) * max(0., 1 - self.load)
+        return math.copysign(speed, drive)
+
+    def update(self, now: float):
+        # """
+        # Integrate motion up to given time with inputs held constant since last update
+
+        # :param now: simulation time, s
+        # """
+        drive = self.drive
+        target_speed = self._target_speed(drive)
+        tau = self.tau if drive else self.coast_tau
+
+        while self._time < now:
+            dt = min(self.MAX_STEP_S, now - self._time)
+            self._time += dt
+
+            # first order speed response, exact for constant input
+            decay = math.exp(-dt / tau)
+            self.position += target_speed * dt + (self.speed - target_speed) * tau * (1 - decay)
+            self.speed = target_speed + (self.speed - target_speed) * decay
+
+            if self.jammed:
+                self.speed = 0.
+
+            if self.position <= self.stop_low:
+                self.position = self.stop_low
+                self.speed = max(0., self.speed)
+            elif self.position >= self.stop_high:
+                self.position = self.stop_high
+                self.speed = min(0., self.speed)
+
+    def adc_u16(self) -> int:
+        # """
+        # ESP8266 ADC reading: 10-bit conversion of noisy potentiometer voltage scaled to u16
+        # """
+        counts = round(self.position * 1023 + self._rnd.gauss(0, self.adc_noise))
+        counts = max(0, min(1023, counts))
+
+        return counts * 65535 // 1023
@@ -0,0 +1,182 @@
+# Boot unchanged firmware (boot.py, main.py) on simulated hardware
+#
+#   python -m simulator.run --duration 600 --profile
+
+import argparse
+import asyncio
+import cProfile
+import importlib
+import json
+import math
+import os
+import pstats
+import sys
+import tempfile
+import threading
+
+import simulator
+from firmware.build_assets import build_assets
+from firmware.compile_templates import compile_templates
+from simulator.ads1115 import ADS1115Model
+from simulator.board import board, Reset
+from simulator.broker import MQTTBroker
+from simulator.clock import VirtualTimeEventLoop
+from simulator.plant import WindowPlant
+
+
+_FIRMWARE_MODULES = ('boot', 'main', 'wa', 'microdot', 'utemplate', 'templates')
+STOP_POLL_S = 0.05  # stop request check period, simulated time
+
+
+def prepare_root(root: str, broker: MQTTBroker, windows: int = 1) -> str:
+    # """
+    # Create device filesystem: built assets, frozen templates and settings pointing to the local broker
+
+    # :param root: filesystem directory, temporary one if None
+    # :param broker: local MQTT broker
+    # :param windows: windows driven by the device
+    # :return: filesystem directory
+    # """
+    if root is None:
+        root = tempfile.mkdtemp(prefix='wa_sim_')
+    html_dir = os.path.join(simulator.PROJECT_DIR, 'src_alive', 'html')
+    build_assets(html_dir, os.path.join(root, 'html'))
+    compile_templates(html_dir, os.path.join(root, 'templates'))
+
+    settings_path = os.path.join(root, 'settings.json')
+    try:
+        with open(settings_path, encoding='utf8') as f:
+            settings = json.load(f)
+    except FileNotFoundError:
+        settings = {'device_name': 'wa_sim', 'wifi_ssid': 'simulated', 'wifi_password': 'simulated'}
+    journal_path = settings_path + '.journal'
+    if os.path.exists(journal_path):
+        # fold changes saved by previous run, they would override the broker address
+        with open(journal_path, encoding='utf8') as f:
+            for line in f:
+                try:
+                    settings.update(json.loads(line))
+                except ValueError:
+                    break
+        os.remove(journal_path)
+    settings['mqtt_server'] = broker.host
+    settings['mqtt_port'] = broker.port
+    if windows != len(settings.get('windows', [{}])):
+        settings['windows'] = [{} for _ in range(windows)]
+    with open(settings_path, 'w', encoding='utf8') as f:
+        json.dump(settings, f)
+
+    return root
+
+
+def _forget_firmware():
+    # """
+    # Unload firmware modules, so next import boots it from scratch
+    # """
+    for name in list(sys.modules):
+        if name.split('.')[0] in _FIRMWARE_MODULES:
+            del sys.modules[name]
+
+    import network
+    network._interfaces.clear()
+    board.reset()
+
+
+async def _firmware(loop: asyncio.AbstractEventLoop, duration: float, http_port: int, stop: threading.Event):
+    importlib.import_module('boot')  # run for its side effects, as on the device
+    import main
+    from wa.web import web_server
+
+    start_server = web_server.start_server
+    web_server.start_server = lambda port=80, **kwargs: start_server(port=http_port, **kwargs)
+
+    loop.set_exception_handler(main.exception_handler)
+    main.main()
+
+    if stop is not None:
+        while not stop.is_set() and (duration is None or board.clock.now() < duration):
+            await asyncio.sleep(STOP_POLL_S)
+    elif duration is None:
+        await asyncio.Event().wait()
+    else:
+        await asyncio.sleep(duration - board.clock.now())
+
+
+def run(duration: float = None, http_port: int = 8080, stop: threading.Event = None):
+    # """
+    # Run firmware until given simulation time, rebooting it on machine.reset()
+
+    # :param duration: simulation time limit, s. None to run forever.
+    # :param http_port: port for firmware web server
+    # :param stop: shut firmware down when set, e.g. by test driver thread
+    # """
+    while (duration is None or board.clock.now() < duration) and not (stop and stop.is_set()):
+        loop = VirtualTimeEventLoop(board.clock)
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(_firmware(loop, duration, http_port, stop))
+        except Reset as reset:
+            print(f'[sim {board.clock.now():.3f}] {reset}, rebooting')
+        finally:
+            web = sys.modules.get('wa.web')
+            if web and web.web_server.server:
+                web.web_server.server.close()  # free the port for rebooted firmware
+            loop.set_exception_handler(None)  # cancelled tasks must not reset firmware again
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            try:
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            except Reset:
+                pass
+            loop.close()
+            _forget_firmware()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run Window Actuator firmware on simulated hardware')
+    parser.add_argument('--speed', type=float, default=math.inf, help='simulation speed vs real time (default: max)')
+    parser.add_argument('--duration', type=float, help='stop after given simulated seconds')
+    parser.add_argument('--root', help='device filesystem directory (default: temporary)')
+    parser.add_argument('--broker-port', type=int, default=0, help='local MQTT broker port (default: any free)')
+    parser.add_argument('--http-port', type=int, default=8080, help='web server port')
+    parser.add_argument('--seed', type=int, help='sensor noise seed')
+    parser.add_argument('--windows', type=int, choices=(1, 2), default=1,
+                        help='windows on driver channels A and B, the second one with external ADC')
+    parser.add_argument('--verbose', action='store_true', help='print MQTT traffic')
+    parser.add_argument('--profile', action='store_true', help='profile firmware and print hot spots on exit')
+    parser.add_argument('--trace-heap', action='store_true', help='make heap diagnostics follow real allocations')
+    args = parser.parse_args()
+
+    simulator.install(speed=args.speed, trace_heap=args.trace_heap)
+    broker = MQTTBroker(port=args.broker_port).start()
+    if args.verbose:
+        broker.observe('#', lambda topic, payload: print(f'[mqtt] {topic} {payload.decode()}'))
+    print(f'MQTT broker: {broker.host}:{broker.port}, web server: http://127.0.0.1:{args.http_port}/')
+
+    root = prepare_root(args.root, broker, args.windows)
+    os.chdir(root)
+    sys.path.insert(0, root)
+
+    WindowPlant(board, seed=args.seed)
+    if args.windows > 1:
+        ADS1115Model(board)
+        WindowPlant(board, cw_pin=16, ccw_pin=14, pwm_pin=5, adc_channel='ads1115:0', position=0.5,
+                    seed=None if args.seed is None else args.seed + 1)
+
+    profiler = cProfile.Profile() if args.profile else None
+    try:
+        if profiler:
+            profiler.enable()
+        run(args.duration, args.http_port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if profiler:
+            profiler.disable()
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(30)
+        broker.stop()
+
+
+if __name__ == '__main__':
+    main()
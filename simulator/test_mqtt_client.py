@@ -0,0 +1,55 @@
+# MQTT client publish queue: message being sent isn't lost to full queue drops
+#
+#   python -m pytest simulator
+
+import asyncio
+
+import simulator
+
+
+class StalledWriter:
+    # """
+    # Connection writer whose first drain waits until released
+    # """
+
+    def __init__(self):
+        self.sent = []
+        self.draining = asyncio.Event()
+        self.release = asyncio.Event()
+
+    def write(self, pkt: bytes):
+        self.sent.append(bytes(pkt[-1:]))  # one byte payloads
+
+    async def drain(self):
+        if not self.release.is_set():
+            self.draining.set()
+            await self.release.wait()
+
+    def close(self):
+        pass
+
+
+def test_full_queue_drop_keeps_message_being_sent():
+    simulator.install()
+    from wa.mqtt_client import MQTTClient
+
+    async def scenario():
+        client = MQTTClient('test', '127.0.0.1')
+        client.QUEUE_SIZE = 3
+        for msg in (b'0', b'1', b'2'):
+            client.publish('t', msg)
+
+        writer = StalledWriter()
+        sender = asyncio.create_task(client._sender(writer))
+        await writer.draining.wait()  # message 0 is being sent
+        client.publish('t', b'3')
+        assert [msg for _, msg, _ in client._queue] == [b'0', b'2', b'3']  # the oldest waiting one is dropped
+        assert client.dropped == 1
+
+        writer.release.set()
+        while client.queued:
+            await asyncio.sleep(0)
+        sender.cancel()
+        return writer.sent
+
+    assert asyncio.run(scenario()) == [b'0', b'2', b'3']
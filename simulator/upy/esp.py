@@ -0,0 +1,9 @@
+# MicroPython `esp` module stand-in
+
+
+def osdebug(level):
+    pass
+
+
+def flash_size() -> int:
+    return 4 * 1024 * 1024
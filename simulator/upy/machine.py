@@ -0,0 +1,172 @@
+# MicroPython `machine` module stand-in backed by simulated board
+
+from simulator.board import board, Reset
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+
+    def __init__(self, id: int, mode: int = -1, pull: int = -1, *, value: int = None):
+        self.id = id
+        self.mode = mode
+        self._value = 0
+        if value is not None:
+            self.value(value)
+        board.pins[id] = self
+
+    def value(self, x=None):
+        if x is None:
+            return self._value
+
+        x = int(bool(x))
+        if x != self._value:
+            board.sync()
+            self._value = x
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def __repr__(self):
+        return f'Pin({self.id})'
+
+
+class Signal:
+    def __init__(self, pin, *args, invert: bool = False, **kwargs):
+        self._pin = pin if isinstance(pin, Pin) else Pin(pin, *args, **kwargs)
+        self._invert = invert
+
+    def value(self, x=None):
+        if x is None:
+            return self._pin.value() ^ self._invert
+
+        self._pin.value(bool(x) ^ self._invert)
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+
+class PWM:
+    def __init__(self, dest: Pin, *, freq: int = 1000, duty: int = None, duty_u16: int = None, duty_ns: int = None):
+        self._pin = dest
+        self._freq = freq
+        self._duty_u16 = 0
+        if duty is not None:
+            self.duty(duty)
+        if duty_u16 is not None:
+            self.duty_u16(duty_u16)
+        board.pwms[dest.id] = self
+
+    def freq(self, value: int = None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty_u16(self, value: int = None):
+        if value is None:
+            return self._duty_u16
+
+        if not 0 <= value <= 65535:
+            raise ValueError('duty_u16 must be from 0 to 65535')
+        if value != self._duty_u16:
+            board.sync()
+            self._duty_u16 = value
+
+    def duty(self, value: int = None):
+        # 10-bit duty of ESP8266 port
+        if value is None:
+            return self._duty_u16 * 1023 // 65535
+        self.duty_u16(min(1023, value) * 65535 // 1023)
+
+    def deinit(self):
+        self.duty_u16(0)
+        board.pwms.pop(self._pin.id, None)
+
+
+class ADC:
+    def __init__(self, id: int):
+        self._id = id
+
+    def read_u16(self) -> int:
+        return board.adc_read(self._id)
+
+    def read(self) -> int:
+        return self.read_u16() >> 6
+
+
+class SoftI2C:
+    def __init__(self, scl: Pin, sda: Pin, *, freq: int = 400000, timeout: int = 50000):
+        self._scl = scl
+        self._sda = sda
+
+    def _device(self, addr: int):
+        device = board.i2c.get(addr)
+        if device is None:
+            raise OSError(19, 'ENODEV')  # no ACK
+        return device
+
+    def writeto_mem(self, addr: int, memaddr: int, buf, *, addrsize: int = 8):
+        self._device(addr).writeto_mem(memaddr, bytes(buf))
+
+    def readfrom_mem_into(self, addr: int, memaddr: int, buf, *, addrsize: int = 8):
+        self._device(addr).readfrom_mem_into(memaddr, buf)
+
+    def scan(self) -> list:
+        return sorted(board.i2c)
+
+
+I2C = SoftI2C  # software implementation on ESP8266 anyway
+
+
+class WDT:
+    def __init__(self, id: int = 0, timeout: int = 5000):
+        self._timeout_s = timeout / 1000
+        self._fed = board.clock.now()
+
+    def feed(self):
+        now = board.clock.now()
+        if now - self._fed > self._timeout_s:
+            raise Reset('watchdog timeout')
+        self._fed = now
+
+
+PWRON_RESET = 0
+WDT_RESET = 1
+SOFT_RESET = 4
+
+
+def reset():
+    raise Reset('machine.reset()')
+
+
+def soft_reset():
+    reset()
+
+
+def reset_cause() -> int:
+    return PWRON_RESET
+
+
+def unique_id() -> bytes:
+    return board.mac[-4:]
+
+
+def freq(hz: int = None):
+    if hz is None:
+        return 80_000_000
+
+
+def idle():
+    pass
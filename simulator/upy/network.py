@@ -0,0 +1,114 @@
+# MicroPython `network` module stand-in backed by simulated board
+
+from simulator.board import board
+
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = 2
+STAT_NO_AP_FOUND = 3
+STAT_CONNECT_FAIL = 4
+STAT_GOT_IP = 5
+
+_hostname = 'espressif'
+_interfaces = {}
+
+
+def hostname(name: str = None):
+    global _hostname
+    if name is None:
+        return _hostname
+    _hostname = name
+
+
+class WLAN:
+    def __new__(cls, interface_id: int = STA_IF):
+        # one object per interface, like on the device
+        nic = _interfaces.get(interface_id)
+        if nic is None:
+            nic = _interfaces[interface_id] = super().__new__(cls)
+            nic._init(interface_id)
+        return nic
+
+    def _init(self, interface_id: int):
+        self._if = interface_id
+        self._active = interface_id == STA_IF
+        self._ssid = None
+        self._bssid = None
+        self._static = None  # static IP config, DHCP if None
+        self._connected_at = None  # simulation time when association completes
+
+    def active(self, is_active: bool = None):
+        if is_active is None:
+            return self._active
+        self._active = bool(is_active)
+        if not self._active:
+            self.disconnect()
+
+    def connect(self, ssid: str = None, key: str = None, *, bssid: bytes = None):
+        self._active = True
+        self._ssid = ssid
+        self._bssid = bssid
+
+        duration = board.wifi_assoc_s
+        if bssid is None:
+            duration += board.wifi_scan_s
+        if self._static is None:
+            duration += board.wifi_dhcp_s
+        self._connected_at = board.clock.now() + duration
+
+    def disconnect(self):
+        self._connected_at = None
+
+    def isconnected(self) -> bool:
+        return (
+            board.wifi_available
+            and self._ssid == board.wifi_ssid
+            and self._bssid in (None, board.wifi_bssid)
+            and self._connected_at is not None
+            and board.clock.now() >= self._connected_at
+        )
+
+    def status(self, param: str = None):
+        if param == 'rssi':
+            return -60
+        if self.isconnected():
+            return STAT_GOT_IP
+        if self._connected_at is not None:
+            if board.clock.now() < self._connected_at:
+                return STAT_CONNECTING
+            return STAT_NO_AP_FOUND
+        return STAT_IDLE
+
+    def ifconfig(self, config=None):
+        if config == 'dhcp':
+            self._static = None
+        elif config is not None:
+            self._static = tuple(config)
+        if not self.isconnected():
+            return ('0.0.0.0',) * 4
+        return self._static or board.wifi_ifconfig
+
+    def config(self, *args, **kwargs):
+        if kwargs:
+            return
+
+        param = args[0]
+        if param == 'mac':
+            return board.mac
+        if param in ('essid', 'ssid'):
+            return self._ssid or ''
+        if param == 'channel':
+            return board.wifi_channel
+        if param == 'hostname':
+            return _hostname
+        raise ValueError('unknown config param')
+
+    def scan(self) -> list:
+        board.clock.sleep(board.wifi_scan_s)  # blocking, like on the device
+        if not board.wifi_available:
+            return []
+        return [(board.wifi_ssid.encode(), board.wifi_bssid, board.wifi_channel, -60, 3, False)]